@@ -1,16 +1,24 @@
 import http.client
-import http.server
 import json
 import logging
+import os
 import pickle
-import socketserver
+import random
 import ssl
 import threading
 import time
 
+import journal
+import metrics
+
+BACKOFF_MAX = 600
+BATCH_SIZE = 200
 CONTENT_TYPE = 'application/json'
 HOST = 'kaloix.de'
 INTERVAL = 10
+JOURNAL_BYTES = journal.MAX_BYTES
+JOURNAL_DIR = 'buffer'
+JOURNAL_DROP = journal.DROP_OLDEST
 PORT = 64918
 TIMEOUT = 60
 SERVER_KEY = 'server.key'
@@ -19,148 +27,188 @@ CLIENT_KEY = 'client.key'
 CLIENT_CERT = 'client.crt'
 CLIENT_CERTS = 'clients.crt'
 
+# registered by the client, the server imports this module as well
+send_seconds = metrics.Histogram(
+    'api_send_seconds', 'Duration of a batch post by the client',
+    register=False)
+
 
 class ApiClient(object):
-    def __init__(self):
+    def __init__(self, journal_dir=JOURNAL_DIR):
         context = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
         context.verify_mode = ssl.CERT_REQUIRED
         context.load_verify_locations(SERVER_CERT)
         context.load_cert_chain(CLIENT_CERT, keyfile=CLIENT_KEY)
-        self.conn = http.client.HTTPSConnection(HOST, PORT, timeout=TIMEOUT,
-                                                context=context)
+        self.conn = PersistentHTTPSConnection(HOST, PORT, timeout=TIMEOUT,
+                                              context=context)
+        self.delivered = int()
+        self.batch_support = True
+        self.buffer = journal.Journal(journal_dir, max_bytes=JOURNAL_BYTES,
+                                      drop=JOURNAL_DROP)
         try:
+            # buffer of older versions
             with open('buffer.pickle', 'rb') as file:
-                self.buffer = pickle.load(file)
+                for item in pickle.load(file):
+                    self.buffer.append(item)
+            os.remove('buffer.pickle')
         except FileNotFoundError:
-            self.buffer = list()
-        self.buffer_send = threading.Event()
+            pass
+        # sensors append to the journal, the sender reads and acks it
         self.buffer_mutex = threading.Lock()
+        self.buffer_send = threading.Event()
+        self.shutdown = threading.Event()
 
     def __enter__(self):
-        self.shutdown = False
         self.sender = threading.Thread(target=self._sender)
         self.sender.start()
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         logging.info('wait for empty buffer')
-        self.shutdown = True
+        self.shutdown.set()
         self.buffer_send.set()
         self.sender.join()
+        self.conn.close()
+        self.buffer.close()
 
     def _sender(self):
+        failures = int()
+        delay = INTERVAL
         self.buffer_send.wait()
-        while not self.shutdown or self.buffer:
-            time.sleep(INTERVAL)
-            with self.buffer_mutex:
-                self._send_buffer()
-                self._backup_buffer()
-            if not self.shutdown:
+        while not self.shutdown.is_set() or self.buffer:
+            if not self.shutdown.is_set():
+                self.shutdown.wait(delay)
+            elif failures:
+                time.sleep(INTERVAL)
+            # cleared before the send so no later item is missed
+            self.buffer_send.clear()
+            if self._send_buffer():
+                failures = int()
+                delay = INTERVAL
+            else:
+                failures += 1
+                delay = _backoff(failures)
+                logging.info('retry in {:.0f}s'.format(delay))
+            if self.buffer:
+                self.buffer_send.set()
+            if not self.shutdown.is_set():
                 self.buffer_send.wait()
 
     def _send_buffer(self):
         start = time.perf_counter()
         count = int()
-        try:
-            self.conn.connect()
-            for item in self.buffer:
-                try:
-                    self._send(**item)
-                except ApiError as err:
-                    logging.error('unable to send {}: {}'.format(item, err))
-                count += 1
-        except (http.client.HTTPException, OSError) as err:
-            logging.warning('postpone send: {}'.format(type(err).__name__))
-        self.buffer = self.buffer[count:]
-        if not self.buffer:
-            self.buffer_send.clear()
-        self.conn.close()
+        while self.buffer:
+            with self.buffer_mutex:
+                batch = self.buffer.pending(
+                    BATCH_SIZE if self.batch_support else 1)
+                position = self.buffer.position
+            reused = self.conn.sock is not None
+            try:
+                with send_seconds.time():
+                    results = self._send(batch)
+            except BatchRejectedError as err:
+                # server without batch support, post one record at a time
+                logging.warning('batch rejected: {}'.format(err))
+                self.batch_support = False
+                continue
+            except ApiError as err:
+                # no result per record, keep the batch for the next try
+                logging.warning('postpone send: {}'.format(err))
+                return False
+            except (http.client.HTTPException, OSError) as err:
+                self.conn.close()
+                if reused:
+                    # server closed the idle connection, reconnect once
+                    continue
+                logging.warning('postpone send: {}'.format(
+                    type(err).__name__))
+                return False
+            for item, result in zip(batch, results):
+                if result['status'] != 201:
+                    logging.error('unable to send {}: {}'.format(
+                        item, result.get('reason')))
+            with self.buffer_mutex:
+                # a full journal may have dropped part of the batch
+                self.buffer.ack(max(
+                    position + len(batch) - self.buffer.position, 0))
+            count += len(batch)
         if count:
-            logging.info('sent {} item{} in {:.1f}s'.format(
-                count, '' if count == 1 else 's', time.perf_counter() - start))
-
-    def _send(self, **kwargs):
+            self.delivered += count
+            logging.info(
+                'sent {} item{} in {:.1f}s, {:.3f} handshakes per item'.format(
+                    count, '' if count == 1 else 's',
+                    time.perf_counter() - start,
+                    self.conn.handshakes / self.delivered))
+        return True
+
+    def _send(self, batch):
         try:
-            body = json.dumps(kwargs)
+            body = json.dumps(batch if self.batch_support else batch[0])
         except TypeError as err:
             raise ApiError(str(err))
-        headers = {'Content-type': CONTENT_TYPE, 'Accept': 'text/plain'}
+        headers = {'Content-type': CONTENT_TYPE, 'Accept': CONTENT_TYPE}
         self.conn.request('POST', '', body, headers)
         resp = self.conn.getresponse()
-        resp.read()
-        if resp.status != 201:
+        content = resp.read()
+        if not self.batch_support:
+            if resp.status >= 500:
+                raise ApiError('{} {}'.format(resp.status, resp.reason))
+            return [{'status': resp.status, 'reason': resp.reason}]
+        if 400 <= resp.status < 500:
+            raise BatchRejectedError('{} {}'.format(resp.status, resp.reason))
+        if resp.status != 200:
             raise ApiError('{} {}'.format(resp.status, resp.reason))
-
-    def _backup_buffer(self):
-        with open('buffer.pickle', 'wb') as file:
-            pickle.dump(self.buffer, file)
+        try:
+            results = json.loads(content.decode())
+        except ValueError as err:
+            raise ApiError('bad json: {}'.format(err))
+        if (type(results) is not list or len(results) != len(batch) or
+                not all(type(result) is dict for result in results)):
+            raise ApiError('invalid results')
+        return results
 
     def send(self, **kwargs):
-        with self.buffer_mutex:
-            self.buffer.append(kwargs)
-            self.buffer_send.set()
-
-
-class ApiServer(object):
-    def __init__(self, handle_function):
-        # FIXME removing ThreadingMixIn may resolve problems
-        self.httpd = ThreadedHTTPServer(('', PORT), HTTPRequestHandler)
-        # TODO do_handshake_on_connect required?
-        self.httpd.socket = ssl.wrap_socket(
-            self.httpd.socket, keyfile=SERVER_KEY, certfile=SERVER_CERT, server_side=True,
-            cert_reqs=ssl.CERT_REQUIRED, ca_certs=CLIENT_CERTS,
-            do_handshake_on_connect=False)
-        self.httpd.handle = handle_function
-
-    def __enter__(self):
-        self.server = threading.Thread(target=self.httpd.serve_forever)
-        self.server.start()
-        return self
+        try:
+            with self.buffer_mutex:
+                self.buffer.append(kwargs)
+        except TypeError as err:
+            logging.error('unable to send {}: {}'.format(kwargs, err))
+            return
+        self.buffer_send.set()
 
-    def __exit__(self, exc_type, exc_value, traceback):
-        logging.info('shutdown api server')
-        self.httpd.shutdown()
-        self.server.join()
 
+class PersistentHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.session = None
+        self.handshakes = int()
+        self.resumptions = int()
 
-class HTTPRequestHandler(http.server.BaseHTTPRequestHandler):
-    def do_POST(self):
-        if self.headers['content-type'] != CONTENT_TYPE:
-            self.send_error(400, 'bad content type')
-            self.end_headers()
+    def connect(self):
+        if not hasattr(ssl, 'SSLSession'):
+            # python before 3.6 can not resume sessions
+            super().connect()
+            self.handshakes += 1
             return
-        try:
-            content_length = int(self.headers['content-length'])
-            content = self.rfile.read(content_length).decode()
-            data = json.loads(content)
-        except ValueError as err:
-            self.send_error(400, 'bad json', str(err))
-            self.end_headers()
-            return
-        if type(data) is not dict:
-            self.send_error(401, 'invalid data')
-            self.end_headers()
-            return
-        try:
-            self.server.handle(**data)
-        except Exception as err:
-            logging.error('{}: {}'.format(type(err).__name__, err))
-            self.send_error(400, 'bad parameters')
-        else:
-            self.send_response(201, 'value received')
-        self.end_headers()
+        # resume the previous tls session to skip the rsa key exchange
+        http.client.HTTPConnection.connect(self)
+        self.sock = self._context.wrap_socket(
+            self.sock, server_hostname=self.host, session=self.session)
+        self.handshakes += 1
+        if self.sock.session_reused:
+            self.resumptions += 1
+        self.session = self.sock.session
 
-    def log_error(self, format_, *args):
-        logging.warning('ip {}, {}'.format(self.address_string(),
-                                           format_ % args))
 
-    def log_message(self, format_, *args):
-        pass
+class ApiError(Exception):
+    pass
 
 
-class ThreadedHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+class BatchRejectedError(ApiError):
     pass
 
 
-class ApiError(Exception):
-    pass
+def _backoff(failures):
+    # exponential backoff with jitter, spread out clients after an outage
+    return random.uniform(INTERVAL, min(INTERVAL * 2 ** failures,
+                                        BACKOFF_MAX))
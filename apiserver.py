@@ -0,0 +1,186 @@
+import asyncio
+import email.utils
+import json
+import logging
+import ssl
+import threading
+
+import api
+import metrics
+
+MAX_CONNECTIONS = 256
+MAX_HEADERS = 32
+MAX_LINE = 8 * 1024
+MAX_BODY = api.BATCH_SIZE * 1024
+
+failed_handshakes = metrics.Counter(
+    'api_handshake_failures_total', 'Failed tls handshakes of clients')
+
+
+class ApiServer(object):
+    def __init__(self, handle_function):
+        self.handle = handle_function
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
+        self.context.verify_mode = ssl.CERT_REQUIRED
+        self.context.load_verify_locations(api.CLIENT_CERTS)
+        self.context.load_cert_chain(api.SERVER_CERT, keyfile=api.SERVER_KEY)
+        self.loop = asyncio.new_event_loop()
+        self.connections = set()
+        self.handshake_failures = int()
+
+    def __enter__(self):
+        self.server = self.loop.run_until_complete(self.loop.create_server(
+            lambda: AcceptProtocol(self), port=api.PORT))
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        logging.info('shutdown api server')
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    async def _shutdown(self):
+        self.server.close()
+        for task in self.connections:
+            task.cancel()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        await self.server.wait_closed()
+
+    async def _connection(self, transport):
+        address = transport.get_extra_info('peername')[0]
+        if len(self.connections) >= MAX_CONNECTIONS:
+            logging.warning('ip {}, too many connections'.format(address))
+            transport.abort()
+            return
+        task = asyncio.current_task(self.loop)
+        self.connections.add(task)
+        try:
+            reader = asyncio.StreamReader(limit=MAX_LINE)
+            protocol = asyncio.StreamReaderProtocol(reader)
+            try:
+                tls_transport = await self.loop.start_tls(
+                    transport, protocol, self.context, server_side=True,
+                    ssl_handshake_timeout=api.TIMEOUT)
+            except OSError as err:
+                self.handshake_failures += 1
+                failed_handshakes.inc()
+                logging.warning('ip {}, tls handshake failed: {}'.format(
+                    address, err))
+                return
+            protocol.connection_made(tls_transport)
+            writer = asyncio.StreamWriter(tls_transport, protocol, reader,
+                                          self.loop)
+            while await self._request(reader, writer, address):
+                pass
+        except (OSError, ValueError, EOFError, asyncio.TimeoutError):
+            # client disappeared, timed out or sent garbage
+            pass
+        except asyncio.CancelledError:
+            # server shutdown, the connection task ends here
+            pass
+        finally:
+            self.connections.discard(task)
+            transport.abort()
+
+    async def _request(self, reader, writer, address):
+        line = await asyncio.wait_for(reader.readline(), api.TIMEOUT)
+        if not line:
+            return False
+        headers = dict()
+        for _ in range(MAX_HEADERS):
+            header = await asyncio.wait_for(reader.readline(), api.TIMEOUT)
+            if header in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = header.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        else:
+            return await self._error(writer, address, 431, 'too many headers')
+        try:
+            method, path, version = line.decode('latin-1').split()
+        except ValueError:
+            return await self._error(writer, address, 400, 'bad request')
+        if method != 'POST':
+            return await self._error(writer, address, 501,
+                                     'unsupported method')
+        if headers.get('content-type') != api.CONTENT_TYPE:
+            return await self._error(writer, address, 400, 'bad content type')
+        try:
+            content_length = int(headers.get('content-length'))
+        except (TypeError, ValueError):
+            return await self._error(writer, address, 400, 'bad json')
+        if not 0 <= content_length <= MAX_BODY:
+            return await self._error(writer, address, 413, 'body too large')
+        content = await asyncio.wait_for(reader.readexactly(content_length),
+                                         api.TIMEOUT)
+        try:
+            data = json.loads(content.decode())
+        except ValueError:
+            return await self._error(writer, address, 400, 'bad json')
+        if type(data) is dict:
+            # single record from clients without batch support
+            error, = self._handle([data])
+            if error:
+                return await self._error(writer, address, 400,
+                                         'bad parameters')
+            status, reason, body = 201, 'value received', b''
+        elif (type(data) is not list or
+                not all(type(item) is dict for item in data)):
+            return await self._error(writer, address, 401, 'invalid data')
+        elif len(data) > api.BATCH_SIZE:
+            return await self._error(writer, address, 413, 'batch too large')
+        else:
+            results = list()
+            for error in self._handle(data):
+                if error:
+                    results.append({'status': 400,
+                                    'reason': 'bad parameters'})
+                else:
+                    results.append({'status': 201})
+            status, reason = 200, 'values processed'
+            body = json.dumps(results).encode()
+        keep_alive = (version == 'HTTP/1.1' and
+                      headers.get('connection', '').lower() != 'close')
+        await self._respond(writer, status, reason, body, keep_alive)
+        return keep_alive
+
+    async def _error(self, writer, address, status, reason):
+        logging.warning('ip {}, code {}, message {}'.format(
+            address, status, reason))
+        await self._respond(writer, status, reason, b'', False)
+        return False
+
+    async def _respond(self, writer, status, reason, body, keep_alive):
+        lines = ['HTTP/1.1 {} {}'.format(status, reason),
+                 'Date: {}'.format(email.utils.formatdate(usegmt=True)),
+                 'Content-Length: {}'.format(len(body))]
+        if body:
+            lines.append('Content-Type: {}'.format(api.CONTENT_TYPE))
+        if not keep_alive:
+            lines.append('Connection: close')
+        head = '\r\n'.join(lines) + '\r\n\r\n'
+        writer.write(head.encode('latin-1') + body)
+        await asyncio.wait_for(writer.drain(), api.TIMEOUT)
+
+    def _handle(self, records):
+        try:
+            errors = self.handle(records)
+        except Exception as err:
+            logging.error('{}: {}'.format(type(err).__name__, err))
+            return [err] * len(records)
+        for error in errors:
+            if error:
+                logging.error('{}: {}'.format(type(error).__name__, error))
+        return errors
+
+
+class AcceptProtocol(asyncio.Protocol):
+    def __init__(self, server):
+        self.server = server
+
+    def connection_made(self, transport):
+        # start_tls pauses reading before the first read, so no client
+        # hello can reach this plain protocol
+        self.server.loop.create_task(self.server._connection(transport))
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import socket
+import ssl
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+
+import api
+import apiserver
+
+SAMPLE_INTERVAL = 0.1
+TIMEOUT_MARGIN = 1
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='drive apiserver.ApiServer with simulated tls clients')
+    parser.add_argument('--clients', type=int, default=200,
+                        help='clients replaying a backlog')
+    parser.add_argument('--backlog', type=int, default=500,
+                        help='records per replaying client')
+    parser.add_argument('--stalled', type=int, default=50,
+                        help='connections that stop in the handshake')
+    parser.add_argument('--abrupt', type=int, default=50,
+                        help='connections reset in the middle of a request')
+    parser.add_argument('--interval', type=float, default=0.5,
+                        help='api.INTERVAL of the clients')
+    parser.add_argument('--timeout', type=float, default=5,
+                        help='api.TIMEOUT of server and clients')
+    parser.add_argument('--limit', type=float, default=120,
+                        help='seconds to wait for all backlogs')
+    parser.add_argument('--port', type=int, default=api.PORT)
+    parser.add_argument('--output', help='write the results as json')
+    args = parser.parse_args()
+    logging.basicConfig(
+        format='[%(asctime)s:%(levelname)s:%(module)s] %(message)s',
+        level=logging.ERROR)
+    directory = tempfile.mkdtemp(prefix='benchmark_load_')
+    cwd = os.getcwd()
+    try:
+        # api reads its certificates relative to the working directory
+        os.chdir(directory)
+        make_certificates()
+        results = run(args)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory)
+    if args.output:
+        with open(args.output, mode='w') as json_file:
+            json.dump(results, json_file, indent=1, sort_keys=True)
+    for key, value in sorted(results.items()):
+        print('{:24} {}'.format(key, value))
+
+
+def make_certificates():
+    # self signed like the deployment, clients.crt lists the client
+    for key, cert in ((api.SERVER_KEY, api.SERVER_CERT),
+                      (api.CLIENT_KEY, api.CLIENT_CERT)):
+        subprocess.check_call(
+            ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+             '-keyout', key, '-out', cert, '-days', '1',
+             '-subj', '/CN=localhost'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    shutil.copy(api.CLIENT_CERT, api.CLIENT_CERTS)
+
+
+def run(args):
+    api.HOST = 'localhost'
+    api.PORT = args.port
+    api.INTERVAL = args.interval
+    api.TIMEOUT = args.timeout
+    # the stalled connections are released before the server stops
+    release = threading.Event()
+    stop = multiprocessing.Event()
+    report = multiprocessing.Queue()
+    server = multiprocessing.Process(
+        target=serve, args=(stop, report, args.port, args.timeout))
+    server.start()
+    _wait_for_port(args.port)
+    sampler = Sampler(server.pid)
+    sampler.start()
+    latencies = list()
+    clients = [LoadClient(latencies, 'journal/{}'.format(index))
+               for index in range(args.clients)]
+    attackers = [threading.Thread(target=stalled, args=(args.port, index % 2,
+                                                        release))
+                 for index in range(args.stalled)]
+    attackers += [threading.Thread(target=abrupt, args=(args.port,))
+                  for _ in range(args.abrupt)]
+    total = args.clients * args.backlog
+    with contextlib.ExitStack() as stack:
+        for thread in attackers:
+            thread.start()
+        start = time.perf_counter()
+        for client in clients:
+            stack.enter_context(client)
+            for index in range(args.backlog):
+                client.send(group='load', name='series', value=float(index),
+                            timestamp=index)
+        while (sum(client.delivered for client in clients) < total and
+               time.perf_counter() - start < args.limit):
+            time.sleep(SAMPLE_INTERVAL)
+        elapsed = time.perf_counter() - start
+        delivered = sum(client.delivered for client in clients)
+    # keep the stalled handshakes open until the server timed them out,
+    # the sampler sees whether their descriptors are freed
+    time.sleep(max(start + args.timeout + TIMEOUT_MARGIN -
+                   time.perf_counter(), 0))
+    sampler.stop()
+    release.set()
+    for thread in attackers:
+        thread.join()
+    stop.set()
+    server_report = report.get()
+    server.join()
+    latencies.sort()
+    return {'clients': args.clients,
+            'records_sent': total,
+            'records_delivered': delivered,
+            'records_received': server_report['records'],
+            'seconds': round(elapsed, 3),
+            'throughput': round(delivered / elapsed, 1),
+            'requests': len(latencies),
+            'latency_p50': _percentile(latencies, 50),
+            'latency_p99': _percentile(latencies, 99),
+            'handshakes': sum(client.conn.handshakes for client in clients),
+            'handshake_failures': server_report['handshake_failures'],
+            'server_threads_start': sampler.threads[0],
+            'server_threads_max': max(sampler.threads),
+            'server_fds_start': sampler.fds[0],
+            'server_fds_max': max(sampler.fds),
+            'server_fds_end': sampler.fds[-1]}
+
+
+def serve(stop, report, port, timeout):
+    # a spawned server does not see the settings of the parent
+    api.PORT = port
+    api.TIMEOUT = timeout
+    received = list()
+
+    def handle(records):
+        received.append(len(records))
+        return [None] * len(records)
+
+    with apiserver.ApiServer(handle) as server:
+        stop.wait()
+        failures = server.handshake_failures
+    report.put({'records': sum(received), 'handshake_failures': failures})
+
+
+def stalled(port, partial, release):
+    # connect and never finish the handshake, half of them send the start
+    # of a client hello
+    try:
+        sock = socket.create_connection(('localhost', port))
+    except OSError:
+        return
+    with sock:
+        if partial:
+            with contextlib.suppress(OSError):
+                sock.sendall(b'\x16\x03\x01\x02\x00\x01\x00\x01\xfc\x03\x03')
+        release.wait()
+
+
+def abrupt(port):
+    # start a request and reset the connection without closing tls
+    context = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
+    context.load_verify_locations(api.SERVER_CERT)
+    context.load_cert_chain(api.CLIENT_CERT, keyfile=api.CLIENT_KEY)
+    try:
+        sock = socket.create_connection(('localhost', port))
+        sock = context.wrap_socket(sock)
+        sock.sendall(b'POST / HTTP/1.1\r\nContent-Type: application/json\r\n'
+                     b'Content-Length: 1000\r\n\r\n[{"group": ')
+    except OSError:
+        return
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                    struct.pack('ii', 1, 0))
+    sock.close()
+
+
+class LoadClient(api.ApiClient):
+    def __init__(self, latencies, journal_dir):
+        super().__init__(journal_dir)
+        self.latencies = latencies
+
+    def _send(self, batch):
+        start = time.perf_counter()
+        try:
+            return super()._send(batch)
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+
+class Sampler(object):
+    # thread and file descriptor count of a process from /proc
+    def __init__(self, pid):
+        self.pid = pid
+        self.threads = list()
+        self.fds = list()
+        self.stopped = threading.Event()
+
+    def start(self):
+        self._sample_once()
+        self.thread = threading.Thread(target=self._sample)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def _sample(self):
+        while not self.stopped.wait(SAMPLE_INTERVAL):
+            self._sample_once()
+
+    def _sample_once(self):
+        with contextlib.suppress(OSError):
+            threads = len(os.listdir('/proc/{}/task'.format(self.pid)))
+            fds = len(os.listdir('/proc/{}/fd'.format(self.pid)))
+            self.threads.append(threads)
+            self.fds.append(fds)
+
+
+def _wait_for_port(port):
+    # the probe counts as one failed handshake
+    for _ in range(100):
+        with contextlib.suppress(OSError):
+            socket.create_connection(('localhost', port)).close()
+            return
+        time.sleep(SAMPLE_INTERVAL)
+    raise RuntimeError('api server did not start')
+
+
+def _percentile(values, percent):
+    if not values:
+        return None
+    return round(values[min(len(values) * percent // 100,
+                            len(values) - 1)], 6)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import glob
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy
+import PIL.Image
+
+import sevensegment
+
+# displayed values, the second digit of 10_50_33 was caught while the
+# display changed from 51 to 52 and lights the segments of both 1 and 2
+EXPECTED = {'seven_segment_15-09-21_10_50_22.png': 51,
+            'seven_segment_15-09-21_10_50_33.png': 'error',
+            'seven_segment_15-09-21_10_50_45.png': 52,
+            'seven_segment_15-09-21_12_12_32.png': 69,
+            'seven_segment_15-09-21_12_12_45.png': 88,
+            'seven_segment_15-09-21_12_12_58.png': 70}
+REPEAT = 200
+SSOCR = './ssocr'
+
+
+def main():
+    directory = sys.argv[1] if len(sys.argv) > 1 else 'doc/'
+    print('{:40} {:>8} {:>10} {:>8} {:>10} {:>8}'.format(
+        'image', 'numpy', 'us', 'ssocr', 'us', 'expected'))
+    failures = list()
+    for filename in sorted(glob.glob('{}/seven_segment_*.png'.format(
+            directory))):
+        name = os.path.basename(filename)
+        image = camera(numpy.asarray(
+            PIL.Image.open(filename).convert('RGB')))
+        result, duration = measure(decode_numpy, image, REPEAT)
+        row = [name, result, duration * 1e6]
+        if os.path.exists(SSOCR):
+            row += measure(decode_ssocr, image, REPEAT // 20)
+            row[-1] *= 1e6
+        else:
+            row += ['-', float('nan')]
+        expected = EXPECTED.get(name)
+        if result != expected:
+            failures.append(name)
+        row += [expected if result == expected else 'FAIL']
+        print('{:40} {:>8} {:>10.1f} {:>8} {:>10.1f} {:>8}'.format(*row))
+    sys.exit(1 if failures else 0)
+
+
+def camera(image):
+    # the samples are ssocr debug images, segments are black and the scan
+    # lines are drawn in color over segments and background alike, the
+    # camera shows light segments on a dark display
+    image = image.astype(int)
+    black = image.sum(axis=2) == 0
+    colored = image.max(axis=2) > image.min(axis=2)
+    padded = numpy.pad(black, 1, mode='constant')
+    covered = ((padded[:-2, 1:-1] & padded[2:, 1:-1]) |
+               (padded[1:-1, :-2] & padded[1:-1, 2:]))
+    return numpy.where(black | colored & covered, 255, 0).astype(numpy.uint8)
+
+
+def measure(function, image, repeat):
+    durations = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(image)
+        durations.append(time.perf_counter() - start)
+    return result, statistics.median(durations)
+
+
+def decode_numpy(image):
+    try:
+        # the options of the client
+        return sevensegment.decode(image)
+    except sevensegment.DecodeError:
+        return 'error'
+
+
+def decode_ssocr(image):
+    # the former path of the client, through a file and a subprocess
+    with tempfile.TemporaryDirectory() as directory:
+        filename = '{}/seven_segment.png'.format(directory)
+        PIL.Image.fromarray(image).save(filename)
+        try:
+            output = subprocess.check_output(
+                [SSOCR, '--number-digits=-1', '--number-pixels=3',
+                 '--one-ratio=2.3', '--threshold=98', 'invert', filename])
+            return int(output)
+        except (subprocess.CalledProcessError, ValueError):
+            return 'error'
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+import argparse
+import collections
+import datetime
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+import numpy
+
+import ephemeris
+import server
+import storage
+
+END = datetime.datetime(2024, 6, 15, 12, tzinfo=datetime.timezone.utc)
+OUTPUT = 'benchmark_server.json'
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='time the data path of server.py on a synthetic fleet')
+    parser.add_argument('--groups', type=int, default=2)
+    parser.add_argument('--series', type=int, default=4,
+                        help='series per group, temperature and switch '
+                             'alternate')
+    parser.add_argument('--years', type=float, default=1)
+    parser.add_argument('--interval', type=int, default=300,
+                        help='seconds between records of a series')
+    parser.add_argument('--records', type=int, default=1000,
+                        help='records ingested per series')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--format', choices=sorted(storage.FORMATS),
+                        default='csv')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default=OUTPUT)
+    args = parser.parse_args()
+    directory = tempfile.mkdtemp(prefix='benchmark_server_')
+    try:
+        results = run(args, directory)
+    finally:
+        shutil.rmtree(directory)
+    with open(args.output, mode='w') as json_file:
+        json.dump(results, json_file, indent=1, sort_keys=True)
+    for stage, stats in sorted(results['stages'].items()):
+        print('{:24} {:6} x {:10.6f}s median {:10.6f}s total'.format(
+            stage, stats['count'], stats['median'], stats['total']))
+    print('results written to {}'.format(args.output))
+
+
+def run(args, directory):
+    data_dir = '{}/data/'.format(directory)
+    web_dir = '{}/web/'.format(directory)
+    os.makedirs(data_dir)
+    os.makedirs(web_dir)
+    sensors = fleet(args.groups, args.series, args.interval)
+    sensor_file = '{}/sensor.json'.format(directory)
+    with open(sensor_file, mode='w') as json_file:
+        json.dump(sensors, json_file, indent='\t')
+    start = time.perf_counter()
+    count = history(data_dir, sensors, args.years, args.seed)
+    if args.format == 'binary':
+        for filename in os.listdir(data_dir):
+            name, year = filename[:-4].rsplit('_', 1)
+            storage.convert(data_dir, name, int(year))
+    generated = time.perf_counter() - start
+    server.DATA_DIR = data_dir
+    server.WEB_DIR = web_dir
+    server.now = END
+    server.storage_format = args.format
+    server.sun = ephemeris.SunTable(data_dir + 'sun.json', server.LATITUDE,
+                                    server.LONGITUDE)
+    stages = collections.defaultdict(list)
+    # startup of the whole fleet without and with rollups on disk
+    for stage in 'startup_cold', 'startup_warm':
+        server.groups.clear()
+        timed(stages[stage], server.load_sensors, sensor_file)
+    # ingest
+    rnd = random.Random(args.seed + 1)
+    for index in range(args.records):
+        server.now = END + datetime.timedelta(
+            seconds=(index + 1) * args.interval)
+        for series_dict in server.groups.values():
+            for series in series_dict.values():
+                record = server.Record(server.now, value(
+                    series.value_type, server.now.timestamp(), rnd))
+                timed(stages['ingest'], series.save, record)
+    # rendering
+    for _ in range(args.repeat):
+        for group, series_dict in server.groups.items():
+            for series in series_dict.values():
+                series.refresh()
+                timed(stages['text_' + type(series).__name__.lower()],
+                      list, series.text)
+            timed(stages['detail_html'], server.detail_html, group,
+                  series_dict.values())
+            server.chart_versions.clear()
+            timed(stages['chart_json'], server.chart_json, group,
+                  series_dict.values())
+            timed(stages['plot_history'], server.plot_history,
+                  list(series_dict.values()),
+                  '{}{}.png'.format(web_dir, group))
+    # summaries of the full history
+    first = (END - datetime.timedelta(days=365 * args.years)).date()
+    for series_dict in server.groups.values():
+        for series in series_dict.values():
+            records = numpy.concatenate([storage.read(
+                data_dir, series.name, year, format_=args.format)
+                for year in range(first.year, END.year + 1)])
+            if type(series) is server.Switch:
+                timed(stages['segments'], server.Switch.segments, records)
+            timed(stages['summaries_' + type(series).__name__.lower()],
+                  list, series._summaries(records, first, END.date()))
+    return {'commit': _commit(),
+            'python': platform.python_version(),
+            'parameters': vars(args),
+            'history_records': count,
+            'history_seconds': generated,
+            'stages': {stage: _stats(durations)
+                       for stage, durations in stages.items()}}
+
+
+def fleet(groups, series, interval):
+    sensors = list()
+    for group in range(groups):
+        for index in range(series):
+            name = 'Group{}Series{}'.format(group, index)
+            if index % 2:
+                output = {'switch': {'group': 'Group{}'.format(group),
+                                     'name': name, 'fail-notify': True}}
+            else:
+                output = {'temperature': {'group': 'Group{}'.format(group),
+                                          'name': name, 'low': 5,
+                                          'high': 80, 'fail-notify': True}}
+            sensors.append({'input': {'hostname': 'benchmark',
+                                      'type': 'synthetic',
+                                      'interval': interval},
+                            'output': output})
+    return sensors
+
+
+def history(directory, sensors, years, seed):
+    rnd = random.Random(seed)
+    end = int(END.timestamp())
+    count = int()
+    for sensor in sensors:
+        interval = sensor['input']['interval']
+        for kind, attr in sensor['output'].items():
+            value_type = bool if kind == 'switch' else float
+            rows = collections.defaultdict(list)
+            timestamp = end - int(years * 365 * 24 * 60 * 60)
+            while timestamp < end:
+                year = datetime.datetime.fromtimestamp(
+                    timestamp, tz=server.TIMEZONE).year
+                rows[year].append('{},{}\n'.format(
+                    timestamp, value(value_type, timestamp, rnd)))
+                # occasional downtime
+                timestamp += interval * (20 if rnd.random() < 0.001 else 1)
+                count += 1
+            for year, lines in rows.items():
+                filename = storage.FORMATS['csv'].format(
+                    directory, attr['name'], year)
+                with open(filename, mode='w') as csv_file:
+                    csv_file.write(''.join(lines))
+    return count
+
+
+def value(value_type, timestamp, rnd):
+    if value_type is bool:
+        # on for a third of the day
+        return math.sin(timestamp / 86400 * 2 * math.pi) < -0.5
+    return round(20 + 15 * math.sin(timestamp / 86400 * 2 * math.pi) +
+                 rnd.gauss(0, 1), 1)
+
+
+def timed(durations, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    durations.append(time.perf_counter() - start)
+    return result
+
+
+def _stats(durations):
+    return {'count': len(durations),
+            'total': sum(durations),
+            'mean': statistics.mean(durations),
+            'median': statistics.median(durations),
+            'min': min(durations),
+            'max': max(durations)}
+
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import w1
+
+# devices per master, a fake sysfs tree as the w1-therm driver lays it out
+MASTERS = {'w1_bus_master1': ['28-000001', '28-000002', '28-000003'],
+           'w1_bus_master2': ['28-000004', '28-000005']}
+REPEAT = 100
+
+
+def main():
+    directory = tempfile.mkdtemp(prefix='benchmark_w1_')
+    try:
+        failures = check(directory)
+    finally:
+        shutil.rmtree(directory)
+    sys.exit(1 if failures else 0)
+
+
+def check(root):
+    devices = make_tree(root)
+    # only the first master supports bulk conversion
+    with open('{}/w1_bus_master1/therm_bulk_read'.format(root),
+              mode='w') as bulk_file:
+        bulk_file.write('0\n')
+    bus = w1.W1Bus('{}/devices'.format(root))
+    for device in devices:
+        bus.add(device)
+    results = list()
+    results.append(('values', all(
+        bus.temperature(device) == expected(device) for device in devices)))
+    with open('{}/w1_bus_master1/therm_bulk_read'.format(root)) as bulk_file:
+        results.append(('bulk trigger', bulk_file.read() == 'trigger\n'))
+    results.append(('fallback', not os.path.exists(
+        '{}/w1_bus_master2/therm_bulk_read'.format(root))))
+    # without bulk conversion only the requested device is read
+    master2 = '{}/w1_bus_master2'.format(os.path.realpath(root))
+    bus.conversions.clear()
+    bus.temperature('28-000004')
+    results.append(('single read',
+                    list(bus.conversions[master2][1]) == ['28-000004']))
+    # a failed crc only fails its own device
+    write_slave(root, 'w1_bus_master2', '28-000005', crc='NO')
+    bus.conversions.clear()
+    results.append(('crc', raises(bus, '28-000005') and
+                    bus.temperature('28-000004') == expected('28-000004')))
+    write_slave(root, 'w1_bus_master2', '28-000005')
+    # a probe that is missing at startup is read once it appears
+    late = '28-000006'
+    bus.add(late)
+    results.append(('missing', raises(bus, late)))
+    write_slave(root, 'w1_bus_master2', late)
+    results.append(('appeared', bus.temperature(late) == expected(late)))
+    # a probe that moves to another master
+    os.remove('{}/devices/{}'.format(root, late))
+    shutil.rmtree('{}/w1_bus_master2/{}'.format(root, late))
+    write_slave(root, 'w1_bus_master1', late)
+    results.append(('moved', bus.temperature(late) == expected(late) and
+                    late in bus.devices['{}/w1_bus_master1'.format(
+                        os.path.realpath(root))]))
+    for name, result in results:
+        print('{:24} {}'.format(name, 'ok' if result else 'FAIL'))
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        bus.conversions.clear()
+        for device in devices:
+            bus.temperature(device)
+    print('{:24} {:.1f}us per device'.format(
+        'read', (time.perf_counter() - start) / REPEAT / len(devices) * 1e6))
+    return [name for name, result in results if not result]
+
+
+def make_tree(root):
+    os.makedirs('{}/devices'.format(root))
+    devices = list()
+    for master, names in sorted(MASTERS.items()):
+        for device in names:
+            write_slave(root, master, device)
+            devices.append(device)
+    return devices
+
+
+def write_slave(root, master, device, crc='YES'):
+    directory = '{}/{}/{}'.format(root, master, device)
+    os.makedirs(directory, exist_ok=True)
+    with open('{}/w1_slave'.format(directory), mode='w') as slave_file:
+        slave_file.write('72 01 4b 46 7f ff 0e 10 57 : crc=57 {}\n'.format(
+            crc))
+        slave_file.write('72 01 4b 46 7f ff 0e 10 57 t={}\n'.format(
+            int(expected(device) * 1e3)))
+    link = '{}/devices/{}'.format(root, device)
+    if not os.path.lexists(link):
+        os.symlink('../{}/{}'.format(master, device), link)
+
+
+def expected(device):
+    return 20 + int(device[-2:]) / 8
+
+
+def raises(bus, device):
+    try:
+        bus.temperature(device)
+    except w1.W1Error:
+        return True
+    return False
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,13 @@
 #!/usr/bin/env python3
 
+import concurrent.futures
+import contextlib
 import datetime
+import heapq
+import io
 import json
 import logging
+import os
 import socket
 import subprocess
 import time
@@ -11,10 +16,15 @@ import numpy
 import scipy.misc
 
 import api
+import metrics
+import sevensegment
 import utility
+import w1
 
 CONFIG = 'sensor.json'
-INTERVAL = 10
+METRICS_HOST = 'localhost'
+METRICS_PORT = None  # set to serve metrics, e.g. 64919
+WORKERS = 4
 
 
 def main():
@@ -23,6 +33,7 @@ def main():
     with open(CONFIG) as json_file:
         sensor_json = json_file.read()
     sensors = list()
+    bus = w1.W1Bus()
     for sensor in json.loads(sensor_json):
         if sensor['input']['hostname'] != hostname:
             continue
@@ -33,40 +44,76 @@ def main():
                  sensor['output']['switch']['group']],
                 [sensor['output']['temperature']['name'],
                  sensor['output']['switch']['name']],
-                sensor['input']['interval']))
+                sensor['input']['interval'],
+                sensor['input'].get('debug', False)))
         elif sensor['input']['type'] == 'ds18b20':
             sensors.append(DS18B20(
                 sensor['input']['file'],
                 [sensor['output']['temperature']['group']],
                 [sensor['output']['temperature']['name']],
-                sensor['input']['interval']))
+                sensor['input']['interval'],
+                bus))
         elif sensor['input']['type'] == 'mdeg_celsius':
             sensors.append(MdegCelsius(
                 sensor['input']['file'],
                 [sensor['output']['temperature']['group']],
                 [sensor['output']['temperature']['name']],
                 sensor['input']['interval']))
-    with api.ApiClient() as connection:
-        while True:
-            for sensor in sensors:
-                now = datetime.datetime.now(tz=datetime.timezone.utc)
-                now = now.replace(microsecond=0)
-                start = time.perf_counter()
-                try:
-                    result = list(sensor.values())
-                except utility.CallDenied:
-                    continue
-                except SensorError as err:
-                    logging.error('failure {}: {}'.format(sensor, err))
-                    continue
-                logging.info('{} updated in {:.3f}s'.format(
-                    sensor, time.perf_counter() - start))
-                for group, name, value in result:
-                    logging.info('{}/{}: {} / {}'.format(group, name,
-                                                         now, value))
-                    connection.send(group=group, name=name, value=value,
-                                    timestamp=int(now.timestamp()))
-            time.sleep(INTERVAL)
+    # next deadline of every sensor, the index breaks ties
+    schedule = [(time.perf_counter(), index, sensor)
+                for index, sensor in enumerate(sensors)]
+    heapq.heapify(schedule)
+    busy = set()
+    with contextlib.ExitStack() as stack:
+        if METRICS_PORT:
+            stack.enter_context(metrics.MetricsServer(METRICS_HOST,
+                                                      METRICS_PORT))
+        connection = stack.enter_context(api.ApiClient())
+        pool = stack.enter_context(
+            concurrent.futures.ThreadPoolExecutor(WORKERS))
+        metrics.registry.append(api.send_seconds)
+        metrics.Gauge('client_buffer_items', 'Records not yet delivered',
+                      function=lambda: len(connection.buffer))
+        while schedule:
+            deadline, index, sensor = heapq.heappop(schedule)
+            time.sleep(max(deadline - time.perf_counter(), 0))
+            now = time.perf_counter()
+            if sensor in busy:
+                logging.warning('{} still busy, skip reading'.format(sensor))
+            else:
+                busy.add(sensor)
+                future = pool.submit(acquire, sensor, connection)
+                future.add_done_callback(
+                    lambda future, sensor=sensor: busy.discard(sensor))
+            missed = int((now - deadline) // sensor.interval)
+            if missed:
+                logging.warning('{} missed {} deadline{}'.format(
+                    sensor, missed, '' if missed == 1 else 's'))
+            deadline += (missed + 1) * sensor.interval
+            heapq.heappush(schedule, (deadline, index, sensor))
+
+
+def acquire(sensor, connection):
+    now = datetime.datetime.now(tz=datetime.timezone.utc)
+    now = now.replace(microsecond=0)
+    start = time.perf_counter()
+    try:
+        result = list(sensor.values())
+    except SensorError as err:
+        logging.error('failure {}: {}'.format(sensor, err))
+        return
+    except Exception:
+        logging.exception('failure {}'.format(sensor))
+        return
+    duration = time.perf_counter() - start
+    if duration > sensor.interval:
+        logging.warning('{} overran its interval by {:.3f}s'.format(
+            sensor, duration - sensor.interval))
+    logging.info('{} updated in {:.3f}s'.format(sensor, duration))
+    for group, name, value in result:
+        logging.info('{}/{}: {} / {}'.format(group, name, now, value))
+        connection.send(group=group, name=name, value=value,
+                        timestamp=int(now.timestamp()))
 
 
 class Sensor(object):
@@ -74,7 +121,7 @@ class Sensor(object):
         self.file = file
         self.groups = groups
         self.names = names
-        self.values = utility.allow_every_x_seconds(interval)(self.values)
+        self.interval = interval
 
     def __repr__(self):
         return '/'.join(self.names)
@@ -85,6 +132,10 @@ class Sensor(object):
 
 
 class Thermosolar(Sensor):
+    def __init__(self, file, groups, names, interval, debug=False):
+        super().__init__(file, groups, names, interval)
+        self.debug = debug
+
     def read(self):
         result = self.thermosolar_once()
         time.sleep(0.5)
@@ -93,43 +144,37 @@ class Thermosolar(Sensor):
         return result
 
     def thermosolar_once(self):
-        # capture image
-        if subprocess.call(['fswebcam',
-                            '--device', self.file,
-                            '--quiet',
-                            '--title', 'Thermosolar',
-                            'thermosolar.jpg']):
-            raise SensorError('camera failure')
-        image = scipy.misc.imread('thermosolar.jpg')
-        # crop seven segment
-        left, top, right, bottom = 46, 53, 160, 118
-        seven_segment = image[top:bottom, left:right]
-        image = self.make_box(image, left, top, right, bottom)
-        # crop pump light
-        left, top, right, bottom = 106, 157, 116, 166
-        pump_light = image[top:bottom, left:right]
-        image = self.make_box(image, left, top, right, bottom)
-        # export boxes
-        scipy.misc.imsave('thermosolar.jpg', image)  # FIXME
-        return self.parse_segment(seven_segment), self.parse_light(pump_light)
+        # capture image to stdout, nothing is written to the card
+        try:
+            jpeg = subprocess.check_output(['fswebcam',
+                                            '--device', self.file,
+                                            '--quiet',
+                                            '--title', 'Thermosolar',
+                                            '-'])
+        except (OSError, subprocess.CalledProcessError) as err:
+            raise SensorError('camera failure') from err
+        image = scipy.misc.imread(io.BytesIO(jpeg))
+        # crop seven segment and pump light as views
+        segment_box = 46, 53, 160, 118
+        light_box = 106, 157, 116, 166
+        result = (self.parse_segment(self.crop(image, *segment_box)),
+                  self.parse_light(self.crop(image, *light_box)))
+        if self.debug:
+            # export boxes
+            image = image.copy()
+            self.make_box(image, *segment_box)
+            self.make_box(image, *light_box)
+            scipy.misc.imsave('thermosolar.jpg', image)
+        return result
+
+    def crop(self, image, left, top, right, bottom):
+        return image[top:bottom, left:right]
 
     def parse_segment(self, image):
-        scipy.misc.imsave('seven_segment.png', image)
-        try:
-            ssocr_output = subprocess.check_output(['./ssocr',
-                                                    '--number-digits=-1',
-                                                    '--number-pixels=3',
-                                                    '--one-ratio=2.3',
-                                                    '--threshold=98',
-                                                    'invert',
-                                                    'seven_segment.png'])
-        except subprocess.CalledProcessError as err:
-            raise SensorError('ssocr exit code {}'.format(err.returncode)) \
-                from err
         try:
-            return int(ssocr_output)
-        except ValueError as err:
-            raise SensorError('invalid ssocr output') from err
+            return sevensegment.decode(image)
+        except sevensegment.DecodeError as err:
+            raise SensorError('seven segment: {}'.format(err)) from err
 
     def parse_light(self, image):
         hist, bin_edges = numpy.histogram(
@@ -153,18 +198,18 @@ class Thermosolar(Sensor):
 
 
 class DS18B20(Sensor):
+    def __init__(self, file, groups, names, interval, bus):
+        super().__init__(file, groups, names, interval)
+        self.bus = bus
+        # the bus finds the device by its id below its root
+        self.device = os.path.basename(os.path.dirname(file))
+        bus.add(self.device)
+
     def read(self):
         try:
-            with open(self.file) as w1_file:
-                if not w1_file.readline().strip().endswith('YES'):
-                    raise SensorError('w1 sensor says no')
-                t_value = w1_file.readline().split('t=')[-1].strip()
-        except OSError as err:
-            raise SensorError('invalid w1 file') from err
-        try:
-            return int(t_value) / 1e3,
-        except ValueError as err:
-            raise SensorError('invalid t value in w1 file') from err
+            return self.bus.temperature(self.device),
+        except w1.W1Error as err:
+            raise SensorError(str(err)) from err
 
 
 class MdegCelsius(Sensor):
@@ -0,0 +1,67 @@
+import datetime
+import json
+import logging
+
+import pysolar
+
+import utility
+
+CACHE_DAYS = 366
+
+
+class SunTable(object):
+    # sunrise and sunset per utc date, computed for a rolling year
+    def __init__(self, filename, latitude, longitude):
+        self.filename = filename
+        self.latitude = latitude
+        self.longitude = longitude
+        self.days = None
+
+    def __call__(self, date):
+        if self.days is None:
+            self._load()
+        try:
+            sunrise, sunset = self.days[date]
+        except KeyError:
+            self._compute(date)
+            sunrise, sunset = self.days[date]
+        return (datetime.datetime.fromtimestamp(sunrise,
+                                                tz=datetime.timezone.utc),
+                datetime.datetime.fromtimestamp(sunset,
+                                                tz=datetime.timezone.utc))
+
+    def _load(self):
+        self.days = dict()
+        try:
+            with open(self.filename) as json_file:
+                table = json.load(json_file)
+        except (OSError, ValueError):
+            return
+        if [table.get('latitude'), table.get('longitude')] != [
+                self.latitude, self.longitude]:
+            return
+        for date, times in table['days'].items():
+            date = datetime.datetime.strptime(date, '%Y-%m-%d').date()
+            self.days[date] = times
+
+    def _compute(self, first):
+        for date in (first + datetime.timedelta(days=d)
+                     for d in range(CACHE_DAYS)):
+            if date in self.days:
+                continue
+            noon = datetime.datetime.combine(date, datetime.time(12))
+            noon = noon.replace(tzinfo=datetime.timezone.utc)
+            sunrise, sunset = pysolar.util.get_sunrise_sunset(
+                self.latitude, self.longitude, noon)
+            self.days[date] = [sunrise.timestamp(), sunset.timestamp()]
+        self.days = {date: times for date, times in self.days.items()
+                     if first - datetime.timedelta(CACHE_DAYS) <= date}
+        table = {'latitude': self.latitude,
+                 'longitude': self.longitude,
+                 'days': {date.isoformat(): times
+                          for date, times in sorted(self.days.items())}}
+        try:
+            with utility.atomic_write(self.filename) as json_file:
+                json.dump(table, json_file)
+        except OSError as err:
+            logging.error('unable to save sun table: {}'.format(err))
@@ -0,0 +1,164 @@
+import collections
+import itertools
+import json
+import logging
+import os
+import time
+
+import utility
+
+DROP_NEWEST = 'newest'
+DROP_OLDEST = 'oldest'
+MAX_BYTES = 64 * 1024 * 1024
+SEGMENT_BYTES = 1024 * 1024
+WARN_INTERVAL = 60
+
+
+class Journal(object):
+    # append-only segments of json lines, an acknowledged position marks
+    # the delivered part and fully delivered segments are deleted
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES,
+                 max_bytes=MAX_BYTES, drop=DROP_OLDEST, fsync=False):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.drop = drop
+        self.fsync = fsync
+        self.entries = collections.deque()
+        self.size = int()
+        self.dropped = int()
+        # number of entries acked since opening
+        self.position = int()
+        self.unreported = int()
+        self.reported = None
+        os.makedirs(directory, exist_ok=True)
+        self.ack_segment, self.ack_offset = self._read_ack()
+        segments = self._segments()
+        for segment in segments:
+            self._recover(segment)
+        self.segment = segments[-1] if segments else self.ack_segment
+        self.file = open(self._filename(self.segment), mode='ab')
+        self._compact()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def close(self):
+        self.file.close()
+
+    def _filename(self, segment):
+        return '{}/{:08d}.log'.format(self.directory, segment)
+
+    def _segments(self):
+        segments = list()
+        for name in os.listdir(self.directory):
+            if name.endswith('.log') and name[:-4].isdigit():
+                segments.append(int(name[:-4]))
+        return sorted(segments)
+
+    def _read_ack(self):
+        try:
+            with open('{}/ack'.format(self.directory)) as ack_file:
+                segment, offset = ack_file.read().split()
+            return int(segment), int(offset)
+        except (OSError, ValueError):
+            return int(), int()
+
+    def _write_ack(self):
+        filename = '{}/ack'.format(self.directory)
+        with utility.atomic_write(filename) as ack_file:
+            ack_file.write('{} {}\n'.format(self.ack_segment,
+                                            self.ack_offset))
+
+    def _recover(self, segment):
+        if segment < self.ack_segment:
+            return
+        offset = self.ack_offset if segment == self.ack_segment else 0
+        with open(self._filename(segment), mode='r+b') as log_file:
+            log_file.seek(offset)
+            for line in log_file:
+                if not line.endswith(b'\n'):
+                    # partial entry from a crash during append
+                    log_file.truncate(offset)
+                    break
+                offset += len(line)
+                try:
+                    item = json.loads(line.decode())
+                except ValueError:
+                    logging.error('skip corrupt journal entry')
+                    continue
+                self.entries.append((item, segment, offset, len(line)))
+                self.size += len(line)
+
+    def append(self, item):
+        line = (json.dumps(item) + '\n').encode()
+        if len(line) > self.max_bytes:
+            # would not fit even into an empty journal
+            self.dropped += 1
+            logging.error('journal entry too large, dropped {} bytes'.format(
+                len(line)))
+            return
+        if self.size + len(line) > self.max_bytes:
+            if self.drop == DROP_NEWEST:
+                self._drop(1, 'newest')
+                return
+            # whole segments at once, one ack for many items
+            count = int()
+            size = self.size
+            segment = None
+            for entry in self.entries:
+                if (size + len(line) <= self.max_bytes and
+                        entry[1] != segment):
+                    break
+                segment = entry[1]
+                size -= entry[3]
+                count += 1
+            self.ack(count)
+            self._drop(count, 'oldest')
+        if self.file.tell() >= self.segment_bytes:
+            self.file.close()
+            self.segment += 1
+            self.file = open(self._filename(self.segment), mode='ab')
+        self.file.write(line)
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self.entries.append((item, self.segment, self.file.tell(),
+                             len(line)))
+        self.size += len(line)
+
+    def _drop(self, count, which):
+        self.dropped += count
+        self.unreported += count
+        now = time.perf_counter()
+        if self.reported is None or now - self.reported >= WARN_INTERVAL:
+            logging.warning('journal full, dropped {} {} items'.format(
+                self.unreported, which))
+            self.unreported = int()
+            self.reported = now
+
+    def pending(self, count):
+        return [entry[0] for entry in itertools.islice(self.entries, count)]
+
+    def ack(self, count):
+        if not count:
+            return
+        for _ in range(count):
+            item, segment, offset, length = self.entries.popleft()
+            self.size -= length
+        self.position += count
+        self.ack_segment, self.ack_offset = segment, offset
+        self._write_ack()
+        self._compact()
+
+    def _compact(self):
+        for segment in self._segments():
+            if segment < self.ack_segment:
+                os.remove(self._filename(segment))
+        # start over once everything written is delivered
+        if (not self.entries and self.ack_segment == self.segment and
+                self.ack_offset >= self.segment_bytes):
+            self.file.close()
+            self.segment += 1
+            self.file = open(self._filename(self.segment), mode='ab')
+            os.remove(self._filename(self.segment - 1))
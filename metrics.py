@@ -0,0 +1,185 @@
+import contextlib
+import http.server
+import logging
+import socketserver
+import threading
+import time
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+registry = list()
+
+
+class Metric(object):
+    # labelled values in the prometheus text format, a function instead of
+    # stored values is called on every scrape
+    kind = None
+
+    def __init__(self, name, description, labels=(), function=None,
+                 register=True):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.function = function
+        self.values = dict()
+        if not self.labels and not function:
+            self.values[()] = self._empty()
+        self.mutex = threading.Lock()
+        if register:
+            registry.append(self)
+
+    def _empty(self):
+        return 0
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError('{} needs labels {}'.format(self.name,
+                                                         self.labels))
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def _samples(self):
+        if self.function:
+            return [('', (), self.function())]
+        with self.mutex:
+            return [('', zip(self.labels, key), value)
+                    for key, value in self.values.items()]
+
+    def expose(self):
+        lines = ['# HELP {} {}'.format(self.name, self.description.replace(
+                     '\\', r'\\').replace('\n', r'\n')),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        for suffix, labels, value in self._samples():
+            lines.append('{}{}{} {}'.format(
+                self.name, suffix, _format_labels(labels),
+                _format_value(value)))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.mutex:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.mutex:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=BUCKETS,
+                 register=True):
+        self.buckets = tuple(buckets)
+        super().__init__(name, description, labels, register=register)
+
+    def _empty(self):
+        return [[0] * len(self.buckets), 0, 0]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.mutex:
+            counts, total, count = entry = self.values.setdefault(
+                key, self._empty())
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            entry[1:] = total + value, count + 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        samples = list()
+        with self.mutex:
+            for key, (counts, total, count) in self.values.items():
+                labels = list(zip(self.labels, key))
+                for bound, bucket in zip(self.buckets + (float('inf'),),
+                                         counts + [count]):
+                    samples.append(('_bucket', labels + [
+                        ('le', _format_value(bound))], bucket))
+                samples.append(('_sum', labels, total))
+                samples.append(('_count', labels, count))
+        return samples
+
+
+def expose():
+    return ''.join(metric.expose() + '\n' for metric in registry)
+
+
+def _format_labels(pairs):
+    labels = ['{}="{}"'.format(name, _escape(value)) for name, value in pairs]
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join(labels))
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace(
+        '"', r'\"')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if type(value) is bool:
+        return str(int(value))
+    return repr(value)
+
+
+class MetricsServer(object):
+    # serves the registry on GET /metrics from a background thread
+    def __init__(self, host, port):
+        self.address = host, port
+
+    def __enter__(self):
+        self.server = _ThreadingHTTPServer(self.address, _MetricsHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        logging.info('metrics on port {}'.format(self.server.server_port))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn,
+                           http.server.HTTPServer):
+    daemon_threads = True
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        try:
+            body = expose().encode()
+        except Exception as err:
+            logging.error('metrics: {}: {}'.format(type(err).__name__, err))
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
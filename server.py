@@ -1,32 +1,47 @@
 #!/usr/bin/env python3
 
 import collections
+import concurrent.futures
 import configparser
 import contextlib
-import csv
 import datetime
-import itertools
+import functools
 import json
 import locale
 import logging
+import multiprocessing
+import os
+import pickle
 import queue
+import sched
 import shutil
 import time
 
 import dateutil.rrule
 import matplotlib.dates
 import matplotlib.pyplot
-import pysolar
+import numpy
 import pytz
 
-import api
+import apiserver
+import ephemeris
+import metrics
 import notify
+import storage
+import timeline
 import utility
 
 ALLOWED_DOWNTIME = datetime.timedelta(minutes=30)
+CHART_POINTS = 500
+COALESCE = 1
 COLOR_CYCLE = ['b', 'g', 'r', 'c', 'm', 'y', 'k']
 DATA_DIR = 'data/'
 INTERVAL = 60
+LATITUDE = 49.2
+LOCALE = 'de_DE.UTF-8'
+LONGITUDE = 11.08
+METRICS_HOST = 'localhost'
+METRICS_PORT = 64919
 PAUSE_WARN_FAILURE = 30 * 24 * 60 * 60
 PAUSE_WARN_VALUE = 24 * 60 * 60
 PLOT_INTERVAL = 10 * 60
@@ -36,20 +51,93 @@ TIMEZONE = pytz.timezone('Europe/Berlin')
 WEB_DIR = '/home/kaloix/html/sensor/'
 
 config = configparser.ConfigParser()
+chart_versions = dict()
 groups = collections.defaultdict(collections.OrderedDict)
+html_versions = dict()
 inbox = queue.Queue()
+plot_jobs = dict()
+plot_versions = dict()
+refresh_event = None
+renderer = None
+scheduler = sched.scheduler(time.monotonic, time.sleep)
+storage_format = 'csv'
+sun = ephemeris.SunTable(DATA_DIR + 'sun.json', LATITUDE, LONGITUDE)
+writer = None
 now = datetime.datetime.now(tz=datetime.timezone.utc)
 Record = collections.namedtuple('Record', 'timestamp value')
-Summary = collections.namedtuple('Summary', 'date minimum maximum')
+Summary = collections.namedtuple('Summary',
+                                 'date minimum maximum mean count')
 Uptime = collections.namedtuple('Uptime', 'date value')
+records_ingested = metrics.Counter(
+    'sensor_records_ingested_total', 'Records accepted from clients',
+    ['series'])
+stage_seconds = metrics.Histogram(
+    'sensor_stage_seconds', 'Duration of a main loop stage', ['stage'])
+plot_seconds = metrics.Histogram(
+    'sensor_plot_seconds', 'Render time of a group plot', ['group'])
+metrics.Gauge('sensor_inbox_depth', 'Records waiting for the main loop',
+              function=inbox.qsize)
 
 
 def main():
-    global now
+    global now, storage_format, sun, writer
     utility.logging_config()
-    locale.setlocale(locale.LC_ALL, 'de_DE.UTF-8')
+    locale.setlocale(locale.LC_ALL, LOCALE)
     config.read('config.ini')
-    with open('sensor.json') as json_file:
+    storage_format = config.get('storage', 'format', fallback='csv')
+    writer = storage.SeriesWriter(
+        DATA_DIR, TIMEZONE,
+        config.getint('storage', 'flush_records',
+                      fallback=storage.FLUSH_RECORDS),
+        config.getfloat('storage', 'flush_seconds',
+                        fallback=storage.FLUSH_SECONDS),
+        config.getboolean('storage', 'fsync', fallback=False),
+        storage_format)
+    sun = ephemeris.SunTable(
+        DATA_DIR + 'sun.json',
+        config.getfloat('location', 'latitude', fallback=LATITUDE),
+        config.getfloat('location', 'longitude', fallback=LONGITUDE))
+    load_sensors('sensor.json')
+    with website(), writer, plot_renderer(), metrics.MetricsServer(
+            config.get('metrics', 'host', fallback=METRICS_HOST),
+            config.getint('metrics', 'port', fallback=METRICS_PORT)), \
+            apiserver.ApiServer(accept_records), notify.MailSender(
+                config['email']['source_address'],
+                config['email']['admin_address'],
+                config['email']['user_address'],
+                config['email'].getboolean('enable_email')) as mail:
+        coalesce = config.getfloat('server', 'coalesce', fallback=COALESCE)
+        _every(PLOT_INTERVAL, make_plots)
+        _every(INTERVAL, _send_mail, mail)
+        update_content(mail)
+        while True:
+            now = datetime.datetime.now(tz=datetime.timezone.utc)
+            delay = scheduler.run(blocking=False)
+            try:
+                item = inbox.get(timeout=delay)
+            except queue.Empty:
+                continue
+            # let a burst of records arrive before updating once
+            time.sleep(coalesce)
+            start = time.perf_counter()
+            now = datetime.datetime.now(tz=datetime.timezone.utc)
+            record_counter = int()
+            with stage_seconds.time(stage='drain'), \
+                    contextlib.suppress(queue.Empty):
+                while True:
+                    group, name, record = item
+                    groups[group][name].save(record)
+                    record_counter += 1
+                    item = inbox.get(block=False)
+            html_counter = update_content(mail)
+            logging.info(
+                'updated website in {:.3f}s, {} new records, {} pages'.format(
+                    time.perf_counter() - start, record_counter,
+                    html_counter))
+
+
+def load_sensors(filename):
+    with open(filename) as json_file:
         sensor_json = json_file.read()
     devices = json.loads(sensor_json,
                          object_pairs_hook=collections.OrderedDict)
@@ -67,38 +155,55 @@ def main():
                     attr['name'],
                     device['input']['interval'],
                     attr['fail-notify'])
-    with website(), api.ApiServer(accept_record), \
-            notify.MailSender(
-                config['email']['source_address'],
-                config['email']['admin_address'],
-                config['email']['user_address'],
-                config['email'].getboolean('enable_email')) as mail:
-        while True:
-            # get new record
-            start = time.perf_counter()
-            now = datetime.datetime.now(tz=datetime.timezone.utc)
-            record_counter = int()
-            with contextlib.suppress(queue.Empty):
-                while True:
-                    group, name, record = inbox.get(block=False)
-                    groups[group][name].save(record)
-                    record_counter += 1
-            # update content
-            for group, series_dict in groups.items():
-                for series in series_dict.values():
-                    if series.error:
-                        mail.queue(series.error, PAUSE_WARN_FAILURE)
-                    if series.warning:
-                        mail.queue(series.warning, PAUSE_WARN_VALUE)
-                detail_html(group, series_dict.values())
-            with contextlib.suppress(utility.CallDenied):
-                make_plots()
-            mail.send_all()
-            # log processing
-            utility.memory_check()
-            logging.info('updated website in {:.3f}s, {} new records'.format(
-                time.perf_counter() - start, record_counter))
-            time.sleep(INTERVAL)
+
+
+def _every(interval, action, *args):
+    action(*args)
+    scheduler.enter(interval, 1, _every, (interval, action) + args)
+
+
+def _send_mail(mail):
+    with stage_seconds.time(stage='mail'):
+        mail.send_all()
+    utility.memory_check()
+
+
+def _refresh(mail):
+    start = time.perf_counter()
+    html_counter = update_content(mail)
+    logging.info('refreshed website in {:.3f}s, {} pages'.format(
+        time.perf_counter() - start, html_counter))
+
+
+@stage_seconds.time(stage='html')
+def update_content(mail):
+    global refresh_event
+    html_counter = int()
+    deadline = None
+    for group, series_dict in groups.items():
+        for series in series_dict.values():
+            series.refresh()
+            if series.error:
+                mail.queue(series.error, PAUSE_WARN_FAILURE)
+            if series.warning:
+                mail.queue(series.warning, PAUSE_WARN_VALUE)
+            if deadline is None or series.deadline < deadline:
+                deadline = series.deadline
+        version = _group_version(series_dict.values())
+        if html_versions.get(group) != version:
+            detail_html(group, series_dict.values())
+            html_versions[group] = version
+            html_counter += 1
+        chart_json(group, series_dict.values())
+    # wake up again when time alone changes the content
+    if refresh_event:
+        with contextlib.suppress(ValueError):
+            scheduler.cancel(refresh_event)
+        refresh_event = None
+    if deadline:
+        refresh_event = scheduler.enter(
+            max((deadline - now).total_seconds(), 0), 0, _refresh, (mail,))
+    return html_counter
 
 
 @contextlib.contextmanager
@@ -113,16 +218,31 @@ def website():
         shutil.copy('static/htaccess_maintenance', WEB_DIR + '.htaccess')
 
 
-def accept_record(group, name, timestamp, value):
+def _parse_record(group, name, timestamp, value):
     timestamp = datetime.datetime.fromtimestamp(int(timestamp),
                                                 tz=datetime.timezone.utc)
-    logging.info('{}: {} / {}'.format(name, timestamp, value))
-    filename = '{}/{}_{}.csv'.format(DATA_DIR, name,
-                                     timestamp.astimezone(TIMEZONE).year)
-    with open(filename, mode='a', newline='') as csv_file:
-        writer = csv.writer(csv_file)
-        writer.writerow((int(timestamp.timestamp()), value))
-    inbox.put((group, name, Record(timestamp, value)))
+    if type(value) not in (bool, int, float):
+        raise TypeError('invalid value {!r}'.format(value))
+    return group, name, Record(timestamp, value)
+
+
+def accept_records(records):
+    results = list()
+    for kwargs in records:
+        try:
+            group, name, record = _parse_record(**kwargs)
+        except Exception as err:
+            results.append(err)
+            continue
+        logging.info('{}: {} / {}'.format(name, record.timestamp,
+                                          record.value))
+        writer.write(name, record.timestamp, record.value)
+        if group in groups and name in groups[group]:
+            # names from clients must not grow the label set
+            records_ingested.inc(series=name)
+        inbox.put((group, name, record))
+        results.append(None)
+    return results
 
 
 def detail_html(group, series_list):
@@ -133,27 +253,149 @@ def detail_html(group, series_list):
     text.append('</ul>')
     values = '\n'.join(text)
     filename = '{}{}.html'.format(WEB_DIR, group)
-    with open(filename, mode='w') as html_file:
+    with utility.atomic_write(filename) as html_file:
         html_file.write(values)
 
 
-@utility.allow_every_x_seconds(PLOT_INTERVAL)
+def _group_version(series_list):
+    return [series.version for series in series_list]
+
+
+def chart_json(group, series_list):
+    for resolution, days in ('day', 1), ('week', RECORD_DAYS):
+        lower = now - datetime.timedelta(days)
+        windows = [series.window(lower) for series in series_list]
+        version = [(len(window), window[-1].timestamp if window else None)
+                   for window in windows]
+        if chart_versions.get((group, resolution)) == version:
+            continue
+        chart = {'start': int(lower.timestamp()),
+                 'end': int(now.timestamp()),
+                 'gap': int(ALLOWED_DOWNTIME.total_seconds()),
+                 'series': list()}
+        for series, window in zip(series_list, windows):
+            if type(series) is Temperature:
+                chart['series'].append({
+                    'name': series.name, 'type': 'temperature',
+                    'points': timeline.lttb(window.rows(), CHART_POINTS)})
+            elif type(series) is Switch:
+                chart['series'].append({
+                    'name': series.name, 'type': 'switch',
+                    'intervals': list(series.intervals.window(
+                        lower.timestamp(), now.timestamp()))})
+        _write_chart(group, resolution, chart)
+        chart_versions[group, resolution] = version
+    version = [(len(series.summary), series.summary[-1].date
+                if series.summary else None) for series in series_list]
+    if chart_versions.get((group, 'summary')) == version:
+        return
+    chart = {'series': list()}
+    for series in series_list:
+        if type(series) is Temperature:
+            chart['series'].append({
+                'name': series.name, 'type': 'temperature',
+                'days': [[summary.date.isoformat(), summary.minimum,
+                          summary.maximum, round(summary.mean, 2)]
+                         for summary in series.summary]})
+        elif type(series) is Switch:
+            chart['series'].append({
+                'name': series.name, 'type': 'switch',
+                'days': [[uptime.date.isoformat(), round(uptime.value, 2)]
+                         for uptime in series.summary]})
+    _write_chart(group, 'summary', chart)
+    chart_versions[group, 'summary'] = version
+
+
+def _write_chart(group, resolution, chart):
+    filename = '{}{}_{}.json'.format(WEB_DIR, group, resolution)
+    with utility.atomic_write(filename) as json_file:
+        json.dump(chart, json_file, separators=(',', ':'))
+
+
+@contextlib.contextmanager
+def plot_renderer():
+    global renderer
+    renderer = _start_renderer()
+    try:
+        yield
+    finally:
+        renderer.shutdown()
+
+
+def _start_renderer():
+    # workers come from a forkserver, a fork of the server would inherit
+    # the locks held by its threads
+    return concurrent.futures.ProcessPoolExecutor(
+        config.getint('plot', 'workers', fallback=os.cpu_count()),
+        mp_context=multiprocessing.get_context('forkserver'),
+        initializer=locale.setlocale, initargs=(locale.LC_ALL, LOCALE))
+
+
+@stage_seconds.time(stage='plots')
 def make_plots():
+    global renderer
+    # the workers get a sun table that already covers the plots, only the
+    # server computes and saves it
+    _nighttime(RECORD_DAYS + 1, now.date())
     for group, series_dict in groups.items():
-        # FIXME svg backend has memory leak in matplotlib 1.4.3
-        plot_history(series_dict.values(), '{}{}.png'.format(WEB_DIR, group))
+        version = _group_version(series_dict.values())
+        if plot_versions.get(group) == version:
+            continue
+        if group in plot_jobs:
+            logging.warning('plot {} still rendering'.format(group))
+            continue
+        # snapshot now, the worker must not see later records
+        snapshot = pickle.dumps(list(series_dict.values()),
+                                pickle.HIGHEST_PROTOCOL)
+        file = '{}{}.png'.format(WEB_DIR, group)
+        try:
+            plot_jobs[group] = renderer.submit(_render_plot, snapshot, now,
+                                               sun, file)
+        except concurrent.futures.process.BrokenProcessPool as err:
+            # a worker died, start over with a new pool at the next plot
+            logging.error('plot renderer broken: {}'.format(err))
+            renderer.shutdown(wait=False)
+            renderer = _start_renderer()
+            return
+        plot_jobs[group].add_done_callback(
+            functools.partial(_plot_done, group, file, version))
 
 
-def _nighttime(count, date_time):
-    date_time -= datetime.timedelta(days=count)
+def _render_plot(snapshot, date_time, sun_table, file):
+    global now, sun
+    now = date_time
+    sun = sun_table
+    start = time.perf_counter()
+    temp_file = '{}.tmp.png'.format(file[:-4])
+    # FIXME svg backend has memory leak in matplotlib 1.4.3
+    plot_history(pickle.loads(snapshot), temp_file)
+    return temp_file, time.perf_counter() - start
+
+
+def _plot_done(group, file, version, future):
+    del plot_jobs[group]
+    try:
+        temp_file, duration = future.result()
+        os.replace(temp_file, file)
+    except Exception as err:
+        logging.error('plot {} failed: {}: {}'.format(
+            group, type(err).__name__, err))
+        return
+    plot_versions[group] = version
+    plot_seconds.observe(duration, group=group)
+    logging.info('plotted {} in {:.3f}s'.format(group, duration))
+
+
+@functools.lru_cache(maxsize=8)
+def _nighttime(count, date):
+    date -= datetime.timedelta(days=count)
     sun_change = list()
     for c in range(0, count + 1):
-        date_time += datetime.timedelta(days=1)
-        sun_change.extend(pysolar.util.get_sunrise_sunset(
-            49.2, 11.08, date_time))
+        date += datetime.timedelta(days=1)
+        sun_change.extend(sun(date))
     sun_change = sun_change[1:-1]
-    for r in range(0, count):
-        yield sun_change[2 * r], sun_change[2 * r + 1]
+    return [(sun_change[2 * r], sun_change[2 * r + 1])
+            for r in range(0, count)]
 
 
 def _plot_records(series_list, days):
@@ -162,7 +404,7 @@ def _plot_records(series_list, days):
         color = next(color_iter)
         if type(series) is Temperature:
             parts = list()
-            for record in series.day if days == 1 else series.records:
+            for record in series.window(now - datetime.timedelta(days)):
                 if (not parts or record.timestamp - parts[-1][-1].timestamp >
                         ALLOWED_DOWNTIME):
                     parts.append(list())
@@ -172,10 +414,11 @@ def _plot_records(series_list, days):
                 matplotlib.pyplot.plot(timestamps, values, label=series.name,
                                        linewidth=2, color=color, zorder=3)
         elif type(series) is Switch:
-            for start, end in series.segments(series.records):
+            for start, end in series.periods(
+                    now - datetime.timedelta(RECORD_DAYS)):
                 matplotlib.pyplot.axvspan(start, end, label=series.name,
                                           color=color, alpha=0.5, zorder=1)
-    for sunset, sunrise in _nighttime(days + 1, now):
+    for sunset, sunrise in _nighttime(days + 1, now.date()):
         matplotlib.pyplot.axvspan(sunset, sunrise, label='Nacht', hatch='//',
                                   facecolor='0.9', edgecolor='0.8', zorder=0)
     matplotlib.pyplot.xlim(now - datetime.timedelta(days), now)
@@ -200,7 +443,7 @@ def _plot_summary(series_list):
                     parts.append(list())
                 parts[-1].append(summary)
             for part in parts:
-                dates, mins, maxs = zip(*part)
+                dates, mins, maxs, *_ = zip(*part)
                 ax1.fill_between(dates, mins, maxs, label=series.name,
                                  color=color, alpha=0.5, interpolate=True,
                                  zorder=0)
@@ -263,46 +506,62 @@ def plot_history(series_list, file):
 # https://github.com/dateutil/dateutil/issues/102
 
 def _month_locator(start, end, tz):
-    lower = start.astimezone(tz).date().replace(day=1)
-    upper = end.astimezone(tz).date()
-    rule = dateutil.rrule.rrule(dateutil.rrule.MONTHLY,
-                                dtstart=lower, until=upper)
-    return [tz.localize(dt) for dt in rule if start <= tz.localize(dt) <= end]
+    return _ticks(start, end, _rule(
+        dateutil.rrule.MONTHLY, start.astimezone(tz).date().replace(day=1),
+        end.astimezone(tz).date(), tz))
 
 
 def _week_locator(start, end, tz):
-    lower = start.astimezone(tz).date()
-    upper = end.astimezone(tz).date()
-    rule = dateutil.rrule.rrule(dateutil.rrule.WEEKLY,
-                                byweekday=dateutil.rrule.MO,
-                                dtstart=lower, until=upper)
-    return [tz.localize(dt) for dt in rule if start <= tz.localize(dt) <= end]
+    return _ticks(start, end, _rule(
+        dateutil.rrule.WEEKLY, start.astimezone(tz).date(),
+        end.astimezone(tz).date(), tz, byweekday=dateutil.rrule.MO))
 
 
 def _day_locator(start, end, tz):
-    lower = start.astimezone(tz).date()
-    upper = end.astimezone(tz).date()
-    rule = dateutil.rrule.rrule(dateutil.rrule.DAILY,
-                                dtstart=lower, until=upper)
-    return [tz.localize(dt) for dt in rule if start <= tz.localize(dt) <= end]
+    return _ticks(start, end, _rule(
+        dateutil.rrule.DAILY, start.astimezone(tz).date(),
+        end.astimezone(tz).date(), tz))
 
 
 def _hour_locator(start, end, step, tz):
-    lower = start.astimezone(tz).date()
-    upper = end.astimezone(tz).replace(tzinfo=None)
-    rule = dateutil.rrule.rrule(dateutil.rrule.HOURLY,
-                                byhour=range(0, 24, step),
-                                dtstart=lower, until=upper)
-    return [tz.localize(dt) for dt in rule if start <= tz.localize(dt) <= end]
-
-
-def _universal_parser(value):
-    if value == 'False':
-        return False
-    elif value == 'True':
-        return True
-    else:
-        return float(value)
+    return _ticks(start, end, _rule(
+        dateutil.rrule.HOURLY, start.astimezone(tz).date(),
+        end.astimezone(tz).date() + datetime.timedelta(1), tz,
+        byhour=range(0, 24, step)))
+
+
+def _ticks(start, end, ticks):
+    return [tick for tick in ticks if start <= tick <= end]
+
+
+# keyed on dates, plots of the same day share the ticks
+@functools.lru_cache(maxsize=16)
+def _rule(freq, lower, upper, tz, **kwargs):
+    rule = dateutil.rrule.rrule(freq, dtstart=lower, until=upper, **kwargs)
+    return [tz.localize(dt) for dt in rule]
+
+
+def _make_record(value_type, timestamp, value):
+    return Record(datetime.datetime.fromtimestamp(
+        timestamp, tz=datetime.timezone.utc), value_type(value))
+
+
+def _local_midnight(date):
+    return TIMEZONE.localize(
+        datetime.datetime.combine(date, datetime.time.min))
+
+
+def _days(timestamps, first, last):
+    # local days from first to last that have records, with their bounds
+    # in epoch seconds and their rows
+    dates = [first + datetime.timedelta(day)
+             for day in range((last - first).days + 2)]
+    bounds = [_local_midnight(date).timestamp() for date in dates]
+    rows = numpy.searchsorted(timestamps, bounds)
+    for index, date in enumerate(dates[:-1]):
+        if rows[index] < rows[index + 1]:
+            yield (date, bounds[index], bounds[index + 1],
+                   slice(rows[index], rows[index + 1]))
 
 
 def _format_timedelta(td):
@@ -349,7 +608,9 @@ def _format_switch(record):
 
 
 class Series(object):
+    summary_type = None
     text = None
+    value_type = None
 
     def __init__(self, name, interval, fail_notify):
         self.name = name
@@ -357,10 +618,14 @@ class Series(object):
         self.notify = fail_notify
         self.fail_status = False
         self.fail_counter = int()
-        self.records = collections.deque()
+        self.version = int()
+        self.state = None
+        self.records = timeline.RecordLog(
+            functools.partial(_make_record, self.value_type))
         self.summary = collections.deque()
-        self._read(now.year - 1)
-        self._read(now.year)
+        self.rollups = storage.RollupStore(DATA_DIR, name)
+        self.persisted = datetime.date.min
+        self._load()
         self._clear()
 
     def __str__(self):
@@ -388,30 +653,77 @@ class Series(object):
             del self.records[-2]
 
     def _clear(self):
-        while (self.records and self.records[0].timestamp < now -
-                datetime.timedelta(RECORD_DAYS)):
-            self.records.popleft()
+        self.records.expire(
+            (now - datetime.timedelta(RECORD_DAYS)).timestamp())
         while (self.summary and self.summary[0].date < (now -
                 datetime.timedelta(SUMMARY_DAYS)).astimezone(TIMEZONE).date()):
             self.summary.popleft()
 
-    def _read(self, year):
-        filename = '{}/{}_{}.csv'.format(DATA_DIR, self.name, year)
-        try:
-            with open(filename, newline='') as csv_file:
-                for row in csv.reader(csv_file):
-                    timestamp = datetime.datetime.fromtimestamp(
-                        int(row[0]), tz=datetime.timezone.utc)
-                    value = _universal_parser(row[1])
-                    record = Record(timestamp, value)
-                    try:
-                        self._append(record)
-                    except OlderThanPreviousError:
-                        # FIXME: remove this except, instead don't save invalid data
-                        continue
-                    self._summarize(record)
-        except OSError:
-            pass
+    def _close_day(self, summary):
+        self.summary.append(summary)
+        if summary.date > self.persisted:
+            self.rollups.append(*summary)
+            self.persisted = summary.date
+
+    def _load(self):
+        # summaries come from the rollup store, raw records are replayed
+        # only for the last RECORD_DAYS
+        local_now = now.astimezone(TIMEZONE)
+        first = (now - datetime.timedelta(RECORD_DAYS)).astimezone(
+            TIMEZONE).date()
+        rollups = [self.summary_type(*row) for row in self.rollups.read()
+                   if len(row) == len(self.summary_type._fields)]
+        if not rollups or rollups[-1].date < first - datetime.timedelta(1):
+            if rollups:
+                start = rollups[-1].date + datetime.timedelta(1)
+            else:
+                start = datetime.date(local_now.year - 1, 1, 1)
+            rollups = self.backfill(start, first - datetime.timedelta(1))
+        if rollups:
+            self.persisted = rollups[-1].date
+        for summary in rollups:
+            if summary.date < first:
+                self.summary.append(summary)
+        lower = _local_midnight(first)
+        for year in range(first.year, local_now.year + 1):
+            self._read(year, int(lower.timestamp()))
+
+    def backfill(self, first, last):
+        lower = _local_midnight(first - datetime.timedelta(1))
+        upper = _local_midnight(last + datetime.timedelta(2))
+        # summarized from the columns, no record objects for years of rows
+        records = numpy.concatenate([storage.read(
+            DATA_DIR, self.name, year, int(lower.timestamp()),
+            storage_format) for year in range(
+                lower.astimezone(TIMEZONE).year,
+                upper.astimezone(TIMEZONE).year + 1)])
+        records = records[:numpy.searchsorted(records['timestamp'],
+                                              upper.timestamp())]
+        rollups = collections.OrderedDict(
+            (row[0], self.summary_type(*row)) for row in self.rollups.read()
+            if len(row) == len(self.summary_type._fields))
+        count = int()
+        for summary in self._summaries(records, first, last):
+            rollups[summary.date] = summary
+            count += 1
+        rollups = sorted(rollups.values())
+        self.rollups.write(rollups)
+        logging.info('{}: backfilled {} days from {} to {}'.format(
+            self.name, count, first, last))
+        return rollups
+
+    def _read(self, year, start):
+        for timestamp, value in storage.read(DATA_DIR, self.name, year,
+                                             start, storage_format).tolist():
+            timestamp = datetime.datetime.fromtimestamp(
+                timestamp, tz=datetime.timezone.utc)
+            record = Record(timestamp, self.value_type(value))
+            try:
+                self._append(record)
+            except OlderThanPreviousError:
+                # FIXME: remove this except, instead don't save invalid data
+                continue
+            self._summarize(record)
 
     @property
     def current(self):
@@ -436,11 +748,37 @@ class Series(object):
 
     @property
     def day(self):
-        min_time = now - datetime.timedelta(days=1)
-        start = len(self.records)
-        while start > 0 and self.records[start - 1].timestamp >= min_time:
-            start -= 1
-        return itertools.islice(self.records, start, None)
+        return self.window(now - datetime.timedelta(days=1))
+
+    def window(self, start, end=None):
+        return self.records.window(
+            start.timestamp(), end.timestamp() if end is not None else None)
+
+    @property
+    def deadline(self):
+        # next time the output changes without a new record
+        deadlines = [_local_midnight(
+            now.astimezone(TIMEZONE).date() + datetime.timedelta(1))]
+        current = self.current
+        if current:
+            deadlines.append(current.timestamp + ALLOWED_DOWNTIME)
+        day = self.day
+        if day:
+            deadlines.append(day[0].timestamp + datetime.timedelta(days=1))
+        if self.records:
+            deadlines.append(self.records[0].timestamp +
+                             datetime.timedelta(RECORD_DAYS))
+        return min(deadlines) + datetime.timedelta(seconds=1)
+
+    def refresh(self):
+        # time passing changes the output on day rollover, expiry of
+        # records and when the series becomes stale
+        self._clear()
+        state = (now.astimezone(TIMEZONE).date(), bool(self.current),
+                 len(self.day), len(self.records), len(self.summary))
+        if state != self.state:
+            self.state = state
+            self.version += 1
 
     def save(self, record):
         try:
@@ -450,40 +788,70 @@ class Series(object):
             return
         self._summarize(record)
         self._clear()
+        self.version += 1
 
 
 class Temperature(Series):
+    summary_type = Summary
+    value_type = float
+
     def __init__(self, low, high, *args):
         self.low = low
         self.high = high
         self.date = datetime.date.min
         self.today = None
+        self.minimum = timeline.TrailingExtremum()
+        self.maximum = timeline.TrailingExtremum(maximum=True)
         super().__init__(*args)
 
+    def minmax(self, start):
+        start = start.timestamp()
+        minimum = self.minimum.query(start)
+        maximum = self.maximum.query(start)
+        if not minimum:
+            return None, None
+        return (_make_record(float, *minimum),
+                _make_record(float, *maximum))
+
+    def _append(self, record):
+        super()._append(record)
+        timestamp = int(record.timestamp.timestamp())
+        self.minimum.add(timestamp, record.value)
+        self.maximum.add(timestamp, record.value)
+
+    def _clear(self):
+        super()._clear()
+        cutoff = (now - datetime.timedelta(RECORD_DAYS)).timestamp()
+        self.minimum.expire(cutoff)
+        self.maximum.expire(cutoff)
+
+    @classmethod
+    def _summary(cls, date, values):
+        return Summary(date, min(values), max(values),
+                       sum(values) / len(values), len(values))
+
     @classmethod
-    def minmax(cls, records):
-        minimum = maximum = None
-        for record in records:
-            if not minimum or record.value <= minimum.value:
-                minimum = record
-            if not maximum or record.value >= maximum.value:
-                maximum = record
-        return minimum, maximum
+    def _summaries(cls, records, first, last):
+        for date, lower, upper, rows in _days(records['timestamp'], first,
+                                              last):
+            values = records['value'][rows]
+            yield Summary(date, float(values.min()), float(values.max()),
+                          float(values.mean()), len(values))
 
     def _summarize(self, record):
         date = record.timestamp.astimezone(TIMEZONE).date()
         if date > self.date:
             if self.today:
-                self.summary.append(Summary(self.date,
-                                            min(self.today), max(self.today)))
+                self._close_day(self._summary(self.date, self.today))
             self.date = date
             self.today = list()
         self.today.append(record.value)
 
     @property
     def text(self):
-        minimum, maximum = self.minmax(self.records)
-        minimum_d, maximum_d = self.minmax(self.day)
+        minimum, maximum = self.minmax(
+            now - datetime.timedelta(RECORD_DAYS))
+        minimum_d, maximum_d = self.minmax(now - datetime.timedelta(days=1))
         yield '{}: {}'.format(
             self.name, _format_temperature(self.current, self.low, self.high))
         if minimum_d:
@@ -510,38 +878,56 @@ class Temperature(Series):
 
 
 class Switch(Series):
+    summary_type = Uptime
+    value_type = bool
+
     def __init__(self, *args):
         self.date = None
+        self.intervals = timeline.IntervalIndex(
+            ALLOWED_DOWNTIME.total_seconds())
         super().__init__(*args)
 
-    @classmethod
-    def uptime(cls, segments):
-        total = datetime.timedelta()
-        for start, stop in segments:
-            total += stop - start
-        return total
+    def uptime(self, start, end=None):
+        if end is None:
+            end = now
+        return datetime.timedelta(seconds=self.intervals.uptime(
+            start.timestamp(), end.timestamp()))
+
+    def periods(self, start, end=None):
+        if end is None:
+            end = now
+        for lower, upper in self.intervals.window(start.timestamp(),
+                                                  end.timestamp()):
+            yield (datetime.datetime.fromtimestamp(lower, tz=TIMEZONE),
+                   datetime.datetime.fromtimestamp(upper, tz=TIMEZONE))
 
     @classmethod
     def segments(cls, records):
-        expect = True
-        for timestamp, value in records:
-            # assume false during downtime
-            if not expect and timestamp - running > ALLOWED_DOWNTIME:
-                expect = True
-                yield start, running
-            if value:
-                running = timestamp
-            # identify segments
-            if expect != value:
-                continue
-            if expect:
-                expect = False
-                start = timestamp
-            else:
-                expect = True
-                yield start, timestamp
-        if not expect:
-            yield start, running
+        # on periods as arrays of start and end, assume off during downtime
+        timestamps = records['timestamp']
+        values = records['value'] != 0
+        gap = ALLOWED_DOWNTIME.total_seconds()
+        on = numpy.flatnonzero(values)
+        if not len(on):
+            return timestamps[on], timestamps[on]
+        new = numpy.ones(len(on), dtype=bool)
+        new[1:] = ((on[1:] != on[:-1] + 1) |
+                   (timestamps[on[1:]] - timestamps[on[:-1]] > gap))
+        last = on[numpy.append(new[1:], True)]
+        after = numpy.minimum(last + 1, len(timestamps) - 1)
+        # an off record in time ends the period, else the last on record
+        closed = ((last + 1 < len(timestamps)) & ~values[after] &
+                  (timestamps[after] - timestamps[last] <= gap))
+        return (timestamps[on[new]],
+                numpy.where(closed, timestamps[after], timestamps[last]))
+
+    @classmethod
+    def _summaries(cls, records, first, last):
+        starts, ends = cls.segments(records)
+        for date, lower, upper, rows in _days(records['timestamp'], first,
+                                              last):
+            overlap = numpy.minimum(ends, upper) - numpy.maximum(starts, lower)
+            yield Uptime(date, float(overlap.clip(min=0).sum()) / 3600)
 
     def _summarize(self, record):  # TODO record.value not used
         date = record.timestamp.astimezone(TIMEZONE).date()
@@ -550,29 +936,26 @@ class Switch(Series):
             return
         if date <= self.date:
             return
-        lower = datetime.datetime.combine(self.date, datetime.time.min)
-        lower = TIMEZONE.localize(lower)
-        upper = datetime.datetime.combine(
-            self.date + datetime.timedelta(days=1),
-            datetime.time.min)
-        upper = TIMEZONE.localize(upper)
-        total = datetime.timedelta()
-        for start, end in self.segments(self.records):
-            if end <= lower or start >= upper:
-                continue
-            if start < lower:
-                start = lower
-            if end > upper:
-                end = upper
-            total += end - start
-        hours = total / datetime.timedelta(hours=1)
-        self.summary.append(Uptime(self.date, hours))
+        uptime = self.uptime(_local_midnight(self.date), _local_midnight(
+            self.date + datetime.timedelta(1)))
+        self._close_day(Uptime(self.date,
+                               uptime / datetime.timedelta(hours=1)))
         self.date = date
 
+    def _append(self, record):
+        super()._append(record)
+        self.intervals.add(int(record.timestamp.timestamp()), record.value)
+
+    def _clear(self):
+        super()._clear()
+        self.intervals.expire(
+            (now - datetime.timedelta(RECORD_DAYS)).timestamp())
+
     @property
     def text(self):
         last_false = last_true = None
-        for record in reversed(self.records):
+        for record in reversed(self.window(
+                now - datetime.timedelta(RECORD_DAYS))):
             if record.value:
                 if not last_true:
                     last_true = record
@@ -587,9 +970,10 @@ class Switch(Series):
         if last_false and (not current or current.value):
             yield 'Zuletzt {}'.format(_format_switch(last_false))
         yield 'Letzte 24 Stunden: Einschaltdauer {}'.format(
-            _format_timedelta(self.uptime(self.segments(self.day))))
+            _format_timedelta(self.uptime(now - datetime.timedelta(days=1))))
         yield 'Letzte 7 Tage: Einschaltdauer {}'.format(
-            _format_timedelta(self.uptime(self.segments(self.records))))
+            _format_timedelta(self.uptime(
+                now - datetime.timedelta(RECORD_DAYS))))
 
     @property
     def warning(self):
@@ -0,0 +1,77 @@
+import numpy
+
+LUMINANCE = numpy.array([0.299, 0.587, 0.114])
+NUMBER_PIXELS = 3
+ONE_RATIO = 2.3
+THRESHOLD = 98
+# segments a to g, clockwise from the top and the middle one last
+DIGITS = {
+    (1, 1, 1, 1, 1, 1, 0): 0,
+    (0, 1, 1, 0, 0, 0, 0): 1,
+    (1, 1, 0, 1, 1, 0, 1): 2,
+    (1, 1, 1, 1, 0, 0, 1): 3,
+    (0, 1, 1, 0, 0, 1, 1): 4,
+    (1, 0, 1, 1, 0, 1, 1): 5,
+    (1, 0, 1, 1, 1, 1, 1): 6,
+    (0, 0, 1, 1, 1, 1, 1): 6,
+    (1, 1, 1, 0, 0, 0, 0): 7,
+    (1, 1, 1, 0, 0, 1, 0): 7,
+    (1, 1, 1, 1, 1, 1, 1): 8,
+    (1, 1, 1, 1, 0, 1, 1): 9,
+    (1, 1, 1, 0, 0, 1, 1): 9}
+
+
+def decode(image, threshold=THRESHOLD, invert=True, one_ratio=ONE_RATIO,
+           number_pixels=NUMBER_PIXELS):
+    # same options as ssocr, invert for light segments on a dark display
+    lit = foreground(image, threshold, invert)
+    digits = [_digit(lit[:, left:right], one_ratio, number_pixels)
+              for left, right in _runs(lit.any(axis=0))]
+    if not digits:
+        raise DecodeError('no digits found')
+    return int(''.join(str(digit) for digit in digits))
+
+
+def foreground(image, threshold=THRESHOLD, invert=True):
+    image = numpy.asarray(image, dtype=float)
+    if image.ndim == 3:
+        image = numpy.dot(image[..., :3], LUMINANCE)
+    low, high = image.min(), image.max()
+    if invert:
+        return image > high - (high - low) * threshold / 100
+    return image < low + (high - low) * threshold / 100
+
+
+def _runs(mask):
+    # start and end of each run of true values
+    edges = numpy.flatnonzero(numpy.diff(numpy.concatenate(
+        ([False], mask, [False])).astype(int)))
+    return zip(edges[::2], edges[1::2])
+
+
+def _digit(lit, one_ratio, number_pixels):
+    rows = numpy.flatnonzero(lit.any(axis=1))
+    lit = lit[rows[0]:rows[-1] + 1]
+    height, width = lit.shape
+    if height / width > one_ratio:
+        return 1
+    # horizontal segments in the middle third of the columns
+    middle = lit[:, width // 3:width - width // 3].mean(axis=1) > 0.5
+    a, g, d = (middle[height * i // 3:height * (i + 1) // 3].sum() >=
+               number_pixels for i in range(3))
+    # vertical segments at a quarter and three quarters of the height
+    upper = lit[height // 8:height * 3 // 8].mean(axis=0) > 0.5
+    lower = lit[height * 5 // 8:height * 7 // 8].mean(axis=0) > 0.5
+    f, b = (upper[:width // 2].sum() >= number_pixels,
+            upper[width // 2:].sum() >= number_pixels)
+    e, c = (lower[:width // 2].sum() >= number_pixels,
+            lower[width // 2:].sum() >= number_pixels)
+    segments = tuple(int(segment) for segment in (a, b, c, d, e, f, g))
+    try:
+        return DIGITS[segments]
+    except KeyError:
+        raise DecodeError('unknown segments {}'.format(segments)) from None
+
+
+class DecodeError(Exception):
+    pass
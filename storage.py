@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+
+import csv
+import datetime
+import bisect
+import glob
+import io
+import logging
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+
+import numpy
+
+import utility
+
+FLUSH_RECORDS = 100
+FLUSH_SECONDS = 10
+FORMATS = {'csv': '{}/{}_{}.csv', 'binary': '{}/{}_{}.bin'}
+INDEX_BYTES = 64 * 1024
+RECORD = struct.Struct('<qd')
+RECORD_DTYPE = numpy.dtype([('timestamp', '<i8'), ('value', '<f8')])
+
+
+def main():
+    utility.logging_config()
+    directory = sys.argv[1] if len(sys.argv) > 1 else 'data/'
+    for filename in sorted(glob.glob('{}/*_*.csv'.format(directory))):
+        name, year = os.path.basename(filename)[:-4].rsplit('_', 1)
+        if not year.isdigit():
+            continue
+        count = convert(directory, name, int(year))
+        logging.info('converted {} records of {}'.format(count, filename))
+
+
+def convert(directory, name, year):
+    records = read_csv(directory, name, year)
+    filename = FORMATS['binary'].format(directory, name, year)
+    with open(filename + '.tmp', mode='wb') as bin_file:
+        bin_file.write(records.tobytes())
+    os.replace(filename + '.tmp', filename)
+    return len(records)
+
+
+def read(directory, name, year, start=None, format_='csv'):
+    if format_ == 'binary':
+        return read_binary(directory, name, year, start)
+    return read_csv(directory, name, year, start)
+
+
+def read_binary(directory, name, year, start=None):
+    filename = FORMATS['binary'].format(directory, name, year)
+    try:
+        # ignore a partial record at the end after a crash
+        count = os.path.getsize(filename) // RECORD_DTYPE.itemsize
+    except FileNotFoundError:
+        count = int()
+    if not count:
+        return numpy.empty(0, dtype=RECORD_DTYPE)
+    records = numpy.memmap(filename, dtype=RECORD_DTYPE, mode='r',
+                           shape=(count,))
+    if start is None:
+        return records
+    return records[numpy.searchsorted(records['timestamp'], start):]
+
+
+def read_csv(directory, name, year, start=None):
+    filename = FORMATS['csv'].format(directory, name, year)
+    rows = list()
+    try:
+        with open(filename, mode='rb') as csv_file:
+            if start is not None:
+                timestamps, offsets = _csv_index(filename, csv_file)
+                position = bisect.bisect_left(timestamps, start)
+                csv_file.seek(offsets[position - 1] if position else 0)
+            text = io.TextIOWrapper(csv_file, newline='')
+            for row in csv.reader(text):
+                timestamp = int(row[0])
+                if start is not None and timestamp < start:
+                    continue
+                rows.append((timestamp, _parse_value(row[1])))
+    except OSError:
+        pass
+    return numpy.array(rows, dtype=RECORD_DTYPE)
+
+
+def _csv_index(filename, csv_file):
+    # sidecar with the timestamp at every INDEX_BYTES of the csv file
+    index_filename = filename + '.idx'
+    timestamps, offsets = list(), list()
+    size = int()
+    try:
+        with open(index_filename) as index_file:
+            size = int(index_file.readline())
+            for line in index_file:
+                timestamp, offset = line.split(',')
+                timestamps.append(int(timestamp))
+                offsets.append(int(offset))
+    except (OSError, ValueError):
+        timestamps, offsets, size = list(), list(), int()
+    end = os.fstat(csv_file.fileno()).st_size
+    if end < size:
+        timestamps, offsets, size = list(), list(), int()
+    if end == size:
+        return timestamps, offsets
+    csv_file.seek(size)
+    for line in csv_file:
+        if not line.endswith(b'\n'):
+            break
+        if not offsets or size - offsets[-1] >= INDEX_BYTES:
+            timestamps.append(int(line.split(b',', 1)[0]))
+            offsets.append(size)
+        size += len(line)
+    with open(index_filename + '.tmp', mode='w') as index_file:
+        index_file.write('{}\n'.format(size))
+        for timestamp, offset in zip(timestamps, offsets):
+            index_file.write('{},{}\n'.format(timestamp, offset))
+    os.replace(index_filename + '.tmp', index_filename)
+    return timestamps, offsets
+
+
+def _parse_number(value):
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def _parse_value(value):
+    if value == 'False':
+        return 0.0
+    elif value == 'True':
+        return 1.0
+    else:
+        return float(value)
+
+
+class RollupStore(object):
+    def __init__(self, directory, name):
+        self.filename = '{}/{}_rollup.csv'.format(directory, name)
+
+    def read(self):
+        rows = list()
+        try:
+            with open(self.filename, newline='') as csv_file:
+                for date, *values in csv.reader(csv_file):
+                    date = datetime.datetime.strptime(date, '%Y-%m-%d').date()
+                    rows.append([date] + [_parse_number(value)
+                                          for value in values])
+        except OSError:
+            pass
+        return rows
+
+    def write(self, rows):
+        with open(self.filename + '.tmp', mode='w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            for date, *values in rows:
+                writer.writerow([date.isoformat()] + list(values))
+        os.replace(self.filename + '.tmp', self.filename)
+
+    def append(self, date, *values):
+        with open(self.filename, mode='a', newline='') as csv_file:
+            csv.writer(csv_file).writerow([date.isoformat()] + list(values))
+
+
+class SeriesWriter(object):
+    def __init__(self, directory, timezone, flush_records=FLUSH_RECORDS,
+                 flush_seconds=FLUSH_SECONDS, fsync=False, format_='csv'):
+        self.directory = directory
+        self.format = format_
+        self.timezone = timezone
+        self.flush_records = flush_records
+        self.flush_seconds = flush_seconds
+        self.fsync = fsync
+        self.queue = queue.Queue()
+        self.files = dict()
+        self.pending = int()
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self._writer)
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        logging.info('flush series writer')
+        self.queue.put(None)
+        self.thread.join()
+
+    def _writer(self):
+        deadline = None
+        while True:
+            timeout = None
+            if deadline is not None:
+                timeout = max(deadline - time.perf_counter(), 0)
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                self._flush()
+                deadline = None
+                continue
+            if item is None:
+                break
+            try:
+                self._write(*item)
+            except OSError as err:
+                logging.error('unable to store {}: {}'.format(item, err))
+            if deadline is None:
+                deadline = time.perf_counter() + self.flush_seconds
+            if self.pending >= self.flush_records:
+                self._flush()
+                deadline = None
+        self._flush()
+        for file, writer in self.files.values():
+            file.close()
+        self.files.clear()
+
+    def _write(self, name, timestamp, value):
+        year = timestamp.astimezone(self.timezone).year
+        try:
+            file, writer = self.files[name, year]
+        except KeyError:
+            file, writer = self._open(name, year)
+        if writer:
+            writer.writerow((int(timestamp.timestamp()), value))
+        else:
+            file.write(RECORD.pack(int(timestamp.timestamp()), value))
+        self.pending += 1
+
+    def _open(self, name, year):
+        # year rollover, the previous file of this series is complete
+        for key in [key for key in self.files if key[0] == name]:
+            file, writer = self.files.pop(key)
+            self._sync(file)
+            file.close()
+        filename = FORMATS[self.format].format(self.directory, name, year)
+        if self.format == 'binary':
+            file = open(filename, mode='ab')
+            # drop a partial record of a crash, later records stay aligned
+            file.truncate(file.tell() - file.tell() % RECORD.size)
+            self.files[name, year] = file, None
+        else:
+            file = open(filename, mode='a', newline='')
+            self.files[name, year] = file, csv.writer(file)
+        return self.files[name, year]
+
+    def _flush(self):
+        if not self.pending:
+            return
+        for file, writer in self.files.values():
+            self._sync(file)
+        self.pending = int()
+
+    def _sync(self, file):
+        file.flush()
+        if self.fsync:
+            os.fsync(file.fileno())
+
+    def write(self, name, timestamp, value):
+        self.queue.put((name, timestamp, value))
+
+
+if __name__ == "__main__":
+    main()
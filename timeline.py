@@ -0,0 +1,218 @@
+import array
+import bisect
+
+COMPACT = 1024
+
+
+class IntervalIndex(object):
+    # on intervals of a switch with prefix sums of their durations,
+    # timestamps are seconds since the epoch
+    def __init__(self, max_gap):
+        self.max_gap = max_gap
+        self.starts = list()
+        self.ends = list()
+        self.before = list()
+        self.head = int()
+        self.open = False
+
+    def __len__(self):
+        return len(self.starts) - self.head
+
+    def __iter__(self):
+        return zip(self.starts[self.head:], self.ends[self.head:])
+
+    def add(self, timestamp, value):
+        # assume off during downtime
+        if self.open and timestamp - self.ends[-1] > self.max_gap:
+            self.open = False
+        if value:
+            if self.open:
+                self.ends[-1] = timestamp
+            else:
+                self._start(timestamp)
+        elif self.open:
+            self.ends[-1] = timestamp
+            self.open = False
+
+    def _start(self, timestamp):
+        if self.starts:
+            self.before.append(self.before[-1] + self.ends[-1] -
+                               self.starts[-1])
+        else:
+            self.before.append(0)
+        self.starts.append(timestamp)
+        self.ends.append(timestamp)
+        self.open = True
+
+    def expire(self, cutoff):
+        while self.head < len(self.starts) and self.ends[self.head] < cutoff:
+            if self.open and self.head == len(self.starts) - 1:
+                break
+            self.head += 1
+        if self.head >= COMPACT and self.head * 2 >= len(self.starts):
+            del self.starts[:self.head]
+            del self.ends[:self.head]
+            del self.before[:self.head]
+            self.head = int()
+
+    def uptime(self, lower, upper):
+        first = bisect.bisect_right(self.ends, lower, self.head)
+        last = bisect.bisect_left(self.starts, upper, self.head) - 1
+        if first > last:
+            return 0
+        total = (self.before[last] - self.before[first] +
+                 self.ends[last] - self.starts[last])
+        total -= max(lower - self.starts[first], 0)
+        total -= max(self.ends[last] - upper, 0)
+        return total
+
+    def window(self, lower, upper):
+        first = bisect.bisect_right(self.ends, lower, self.head)
+        last = bisect.bisect_left(self.starts, upper, self.head)
+        return zip(self.starts[first:last], self.ends[first:last])
+
+
+class TrailingExtremum(object):
+    # monotonic queue, the extremum of any trailing window is the first
+    # entry inside the window, ties resolve to the latest entry
+    def __init__(self, maximum=False):
+        self.maximum = maximum
+        self.timestamps = array.array('q')
+        self.values = array.array('d')
+        self.head = int()
+
+    def add(self, timestamp, value):
+        while len(self.values) > self.head and (
+                self.values[-1] <= value if self.maximum else
+                self.values[-1] >= value):
+            del self.timestamps[-1]
+            del self.values[-1]
+        self.timestamps.append(timestamp)
+        self.values.append(value)
+
+    def expire(self, cutoff):
+        self.head = bisect.bisect_left(self.timestamps, cutoff, self.head)
+        if self.head >= COMPACT and self.head * 2 >= len(self.timestamps):
+            del self.timestamps[:self.head]
+            del self.values[:self.head]
+            self.head = int()
+
+    def query(self, lower):
+        index = bisect.bisect_left(self.timestamps, lower, self.head)
+        if index < len(self.timestamps):
+            return self.timestamps[index], self.values[index]
+        return None
+
+
+class RecordLog(object):
+    # records in time order as columns of epoch seconds and values, the
+    # factory turns a row back into a record on access
+    def __init__(self, factory):
+        self.factory = factory
+        self.timestamps = array.array('q')
+        self.values = array.array('d')
+        self.head = int()
+
+    def __len__(self):
+        return len(self.timestamps) - self.head
+
+    def __iter__(self):
+        return iter(self.window())
+
+    def __reversed__(self):
+        return reversed(self.window())
+
+    def __getitem__(self, index):
+        position = self._position(index)
+        return self.factory(self.timestamps[position], self.values[position])
+
+    def __delitem__(self, index):
+        position = self._position(index)
+        del self.timestamps[position]
+        del self.values[position]
+
+    def _position(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('record index out of range')
+        return self.head + index
+
+    def append(self, record):
+        self.timestamps.append(int(record.timestamp.timestamp()))
+        self.values.append(record.value)
+
+    def expire(self, cutoff):
+        self.head = bisect.bisect_left(self.timestamps, cutoff, self.head)
+        if self.head >= COMPACT and self.head * 2 >= len(self.timestamps):
+            del self.timestamps[:self.head]
+            del self.values[:self.head]
+            self.head = int()
+
+    def bisect(self, timestamp):
+        return bisect.bisect_left(self.timestamps, timestamp,
+                                  self.head) - self.head
+
+    def window(self, start=None, end=None):
+        first = self.bisect(start) if start is not None else 0
+        last = self.bisect(end) if end is not None else len(self)
+        return Window(self, first, last)
+
+
+class Window(object):
+    # view of the records from first to last without copying them
+    def __init__(self, log, first, last):
+        self.log = log
+        self.first = first
+        self.last = last
+
+    def __len__(self):
+        return max(self.last - self.first, 0)
+
+    def __iter__(self):
+        return map(self.log.__getitem__, range(self.first, self.last))
+
+    def __reversed__(self):
+        return map(self.log.__getitem__,
+                   reversed(range(self.first, self.last)))
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('window index out of range')
+        return self.log[self.first + index]
+
+    def rows(self):
+        lower = self.log.head + self.first
+        upper = self.log.head + max(self.last, self.first)
+        return list(zip(self.log.timestamps[lower:upper],
+                        self.log.values[lower:upper]))
+
+
+def lttb(points, threshold):
+    # largest triangle three buckets downsampling of (x, y) points
+    if threshold < 3 or len(points) <= threshold:
+        return list(points)
+    sampled = [points[0]]
+    every = (len(points) - 2) / (threshold - 2)
+    previous = 0
+    for bucket in range(threshold - 2):
+        start = int(bucket * every) + 1
+        end = int((bucket + 1) * every) + 1
+        following = points[end:min(int((bucket + 2) * every) + 1,
+                                   len(points))]
+        average_x = sum(x for x, y in following) / len(following)
+        average_y = sum(y for x, y in following) / len(following)
+        a_x, a_y = points[previous]
+        maximum = -1
+        for index in range(start, end):
+            x, y = points[index]
+            area = abs((a_x - average_x) * (y - a_y) -
+                       (a_x - x) * (average_y - a_y))
+            if area > maximum:
+                maximum = area
+                previous = index
+        sampled.append(points[previous])
+    sampled.append(points[-1])
+    return sampled
@@ -1,7 +1,8 @@
+import contextlib
 import gc
 import logging
+import os
 import resource
-import time
 
 
 def logging_config():
@@ -18,27 +19,18 @@ def memory_check():
         raise MemoryLeakError('{} MB'.format(memory))
 
 
-def allow_every_x_seconds(interval):
-    def decorating_function(user_function):
-        target = int()
-
-        def new_function(*args, **kwargs):
-            nonlocal target
-            now = time.perf_counter()
-            if now >= target:
-                target = now + interval
-                return user_function(*args, **kwargs)
-            else:
-                raise CallDenied
-
-        return new_function
-
-    return decorating_function
+@contextlib.contextmanager
+def atomic_write(filename, mode='w'):
+    temp_filename = '{}.{}.tmp'.format(filename, os.getpid())
+    try:
+        with open(temp_filename, mode=mode) as file:
+            yield file
+        os.replace(temp_filename, filename)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_filename)
+        raise
 
 
 class MemoryLeakError(Exception):
     pass
-
-
-class CallDenied(Exception):
-    pass
@@ -0,0 +1,122 @@
+import collections
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+
+COALESCE = 1
+CONVERSION_POLL = 0.05
+CONVERSION_TIMEOUT = 2
+ROOT = '/sys/bus/w1/devices'
+WORKERS = 8
+
+
+class W1Bus(object):
+    # ds18b20 devices grouped by bus master, one bulk conversion per master
+    # and the scratchpads read concurrently, reads requested together share
+    # one conversion
+    def __init__(self, root=ROOT, workers=WORKERS):
+        self.root = root
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers)
+        self.devices = collections.defaultdict(list)
+        self.locks = dict()
+        self.conversions = dict()
+        self.mutex = threading.Lock()
+
+    def add(self, device):
+        # a missing probe joins its master on the first read after it
+        # appeared
+        if os.path.exists(self._path(device)):
+            self.master(device)
+
+    def master(self, device):
+        # device directories link into the directory of their master
+        path = self._path(device)
+        if not os.path.exists(path):
+            raise W1Error('w1 device missing')
+        master = os.path.dirname(os.path.realpath(path))
+        with self.mutex:
+            if device not in self.devices[master]:
+                for devices in self.devices.values():
+                    if device in devices:
+                        devices.remove(device)
+                self.devices[master].append(device)
+            self.locks.setdefault(master, threading.Lock())
+        return master
+
+    def _path(self, device):
+        return os.path.join(self.root, device)
+
+    def temperature(self, device):
+        master = self.master(device)
+        requested = time.perf_counter()
+        with self.locks[master]:
+            conversion = self.conversions.get(master)
+            if (conversion is None or device not in conversion[1] or
+                    conversion[0] < requested - COALESCE):
+                started = time.perf_counter()
+                conversion = started, self.convert(master, device)
+                self.conversions[master] = conversion
+        result = conversion[1][device]
+        if isinstance(result, W1Error):
+            raise W1Error(str(result))
+        return result
+
+    def convert(self, master, device):
+        if self._bulk(master):
+            with self.mutex:
+                devices = list(self.devices[master])
+        else:
+            # every read starts its own conversion, read the requested
+            # device only
+            logging.debug('no bulk conversion on {}'.format(master))
+            devices = [device]
+        futures = [self.executor.submit(read_slave, '{}/w1_slave'.format(
+            self._path(device))) for device in devices]
+        results = dict()
+        for device, future in zip(devices, futures):
+            try:
+                results[device] = future.result()
+            except W1Error as err:
+                results[device] = err
+        return results
+
+    def _bulk(self, master):
+        filename = '{}/therm_bulk_read'.format(master)
+        if not os.path.exists(filename):
+            return False
+        try:
+            with open(filename, mode='w') as bulk_file:
+                bulk_file.write('trigger\n')
+        except OSError:
+            return False
+        deadline = time.perf_counter() + CONVERSION_TIMEOUT
+        while time.perf_counter() < deadline:
+            try:
+                with open(filename) as bulk_file:
+                    if bulk_file.read().strip() != '-1':
+                        return True
+            except OSError:
+                return False
+            time.sleep(CONVERSION_POLL)
+        logging.warning('bulk conversion timeout on {}'.format(master))
+        return False
+
+
+def read_slave(filename):
+    try:
+        with open(filename) as w1_file:
+            if not w1_file.readline().strip().endswith('YES'):
+                raise W1Error('w1 sensor says no')
+            t_value = w1_file.readline().split('t=')[-1].strip()
+    except OSError as err:
+        raise W1Error('invalid w1 file') from err
+    try:
+        return int(t_value) / 1e3
+    except ValueError as err:
+        raise W1Error('invalid t value in w1 file') from err
+
+
+class W1Error(Exception):
+    pass